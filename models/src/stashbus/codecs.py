@@ -0,0 +1,197 @@
+"""Payload codecs shared by the publishers, the stasher and the web.
+
+The fastest available JSON implementation is picked by ``get_codec("auto")``:
+orjson, then msgspec, then the standard library.
+
+The binary formats (MessagePack, CBOR) are opt-in per topic. Their messages
+carry the MQTT v5 content type, which ``CodecSet`` uses to pick the decoder,
+while the untagged messages stay JSON.
+"""
+
+import json
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Protocol
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None  # type: ignore
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None  # type: ignore
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None  # type: ignore
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover
+    cbor2 = None  # type: ignore
+
+
+class Codec(Protocol):
+    name: str
+    content_type: str
+
+    def loads(self, data: bytes) -> Any: ...
+
+    def dumps(self, obj: Any) -> bytes: ...
+
+
+def default(obj: Any) -> Any:
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    # bson.ObjectId and friends
+    return str(obj)
+
+
+class StdlibJSONCodec:
+    name = "json"
+    content_type = "application/json"
+
+    def loads(self, data: bytes) -> Any:
+        return json.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return json.dumps(obj, default=default, separators=(",", ":")).encode()
+
+
+class OrjsonCodec:
+    name = "orjson"
+    content_type = "application/json"
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is not installed.")
+
+    def loads(self, data: bytes) -> Any:
+        return orjson.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return orjson.dumps(obj, default=default)
+
+
+class MsgspecJSONCodec:
+    name = "msgspec"
+    content_type = "application/json"
+
+    def __init__(self):
+        if msgspec is None:
+            raise ImportError("msgspec is not installed.")
+        self.decoder = msgspec.json.Decoder()
+        self.encoder = msgspec.json.Encoder(enc_hook=default)
+
+    def loads(self, data: bytes) -> Any:
+        return self.decoder.decode(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.encoder.encode(obj)
+
+
+class MsgpackCodec:
+    name = "msgpack"
+    content_type = "application/msgpack"
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("msgpack is not installed.")
+
+    def loads(self, data: bytes) -> Any:
+        return msgpack.unpackb(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        return msgpack.packb(obj, default=default)
+
+
+class CBORCodec:
+    name = "cbor"
+    content_type = "application/cbor"
+
+    def __init__(self):
+        if cbor2 is None:
+            raise ImportError("cbor2 is not installed.")
+
+    def loads(self, data: bytes) -> Any:
+        return cbor2.loads(data)
+
+    def dumps(self, obj: Any) -> bytes:
+        # cbor2 has native datetime tags, but the payloads should decode to
+        # the same values whatever the format.
+        return cbor2.dumps(isoformat_dates(obj), default=self.encode_default)
+
+    @staticmethod
+    def encode_default(encoder: Any, value: Any):
+        encoder.encode(default(value))
+
+
+def isoformat_dates(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return {key: isoformat_dates(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [isoformat_dates(value) for value in obj]
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    return obj
+
+
+CODECS: Dict[str, Callable[[], Codec]] = {
+    OrjsonCodec.name: OrjsonCodec,
+    MsgspecJSONCodec.name: MsgspecJSONCodec,
+    StdlibJSONCodec.name: StdlibJSONCodec,
+}
+
+
+def get_codec(name: str = "auto") -> Codec:
+    if name != "auto":
+        return CODECS[name]()
+    for factory in CODECS.values():
+        try:
+            return factory()
+        except ImportError:
+            continue
+    raise AssertionError("The stdlib codec is always available.")
+
+
+BINARY_CODECS: Dict[str, Callable[[], Codec]] = {
+    MsgpackCodec.name: MsgpackCodec,
+    CBORCodec.name: CBORCodec,
+}
+
+ENCODINGS = ["json", *BINARY_CODECS]
+
+
+def get_encoder(encoding: str = "json") -> Codec:
+    """Codec of a wire format, the fastest implementation for JSON."""
+    if encoding == "json":
+        return get_codec()
+    return BINARY_CODECS[encoding]()
+
+
+class CodecSet:
+    """Decoders by the content type of the messages.
+
+    The messages without a content type are decoded with ``default``.
+    """
+
+    def __init__(self, default: Codec):
+        self.default = default
+        self._codecs: Dict[str, Codec] = {default.content_type: default}
+        self._factories = {
+            factory.content_type: factory for factory in BINARY_CODECS.values()
+        }
+
+    def for_content_type(self, content_type: str | None) -> Codec:
+        if not content_type:
+            return self.default
+        content_type = content_type.split(";")[0].strip().lower()
+        codec = self._codecs.get(content_type)
+        if codec is None:
+            factory = self._factories.get(content_type)
+            if factory is None:
+                raise ValueError(f"Unsupported content type {content_type}.")
+            codec = self._codecs[content_type] = factory()
+        return codec
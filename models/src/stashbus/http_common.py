@@ -1,5 +1,6 @@
 import asyncio
 from abc import abstractmethod
+from weakref import WeakKeyDictionary
 import httpx
 from stashbus.models.mqtt_models import (
     Payload,
@@ -8,12 +9,26 @@ from stashbus.models.mqtt_models import (
     OpenWeatherResponse,
     Price,
 )
-from typing import TypeVar, Generic, Type
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    Dict,
+    Iterable,
+    Tuple,
+    TypeVar,
+    Generic,
+    Type,
+)
 from enum import StrEnum
 from dataclasses import field, dataclass
 import urllib.parse
 from datetime import datetime
-from stashbus.models.rest_models import DataProducer, Command, Secret, MempoolResponse
+from stashbus.models.adapters import adapter
+from stashbus.models.rest_models import DataProducer, Command, MempoolPrice, Secret
+from stashbus.resilience import UPSTREAMS, CircuitOpenError, UpstreamError
+from stashbus.secret_cache import SecretCache
+from stashbus.stages import timed
 import logging
 from pydantic import ValidationError
 
@@ -29,11 +44,87 @@ class NoAuth(httpx.Auth):
     pass
 
 
+@dataclass
+class HTTPPool:
+    """Keep-alive HTTP clients shared by everything running on an event loop.
+
+    An httpx.AsyncClient must not be used from another event loop than the
+    one it was created in, so there is one client per loop.
+    """
+
+    http2: bool = False
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    timeout: float = 10.0
+    _clients: WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient] = (
+        field(default_factory=WeakKeyDictionary, init=False)
+    )
+
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = self._clients[loop] = httpx.AsyncClient(
+                http2=self.http2,
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_keepalive_connections,
+                ),
+                timeout=self.timeout,
+            )
+        return client
+
+    async def aclose(self):
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+HTTP_POOL = HTTPPool()
+
+SECRETS = SecretCache()
+
+R = TypeVar("R")
+
+
+def run_sync(coro: Coroutine[Any, Any, R]) -> R:
+    """Run coro in a throwaway event loop, closing the loop's HTTP client."""
+
+    async def main() -> R:
+        try:
+            return await coro
+        finally:
+            await HTTP_POOL.aclose()
+
+    return asyncio.run(main())
+
+
+@dataclass
+class CachedResponse:
+    """Body of the last response and its validators, for conditional GETs."""
+
+    url: str
+    content: bytes
+    etag: str | None
+    last_modified: str | None
+
+    def headers(self) -> Dict[str, str]:
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
 T = TypeVar("T", bound=Payload)
 
 
 class DataClient(Generic[T]):
-    http_cli = httpx.Client()
+    # Send the validators of the previous response, so that an upstream
+    # which supports them answers 304 instead of the same body again.
+    conditional: bool = True
+    cached: CachedResponse | None = None
 
     @property
     @abstractmethod
@@ -49,32 +140,71 @@ class DataClient(Generic[T]):
     def auth(self) -> httpx.Auth:
         return NoAuth()
 
+    async def fetch(self) -> bytes:
+        url = self.url
+        cached = self.cached if self.cached and self.cached.url == url else None
+        headers = cached.headers() if cached else {}
+        upstream = UPSTREAMS.get(httpx.URL(url).host)
+        try:
+            response = await upstream.call(
+                lambda: HTTP_POOL.client().get(url, auth=self.auth, headers=headers)
+            )
+        except CircuitOpenError as err:
+            raise StashbusError(str(err)) from err
+        except UpstreamError as err:
+            raise StashbusError(f"{err} {err.response.text}") from err
+        if cached and response.status_code == httpx.codes.NOT_MODIFIED:
+            logging.debug("%s not modified.", url)
+            return cached.content
+        try:
+            response.raise_for_status()
+        except Exception as err:
+            new_exc = StashbusError(f"{err} {response.text}")
+            raise new_exc from err
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if self.conditional and (etag or last_modified):
+            self.cached = CachedResponse(url, response.content, etag, last_modified)
+        else:
+            self.cached = None
+        return response.content
+
     async def aget_data(self) -> T:
-        async with httpx.AsyncClient() as http_cli:
-            response = await http_cli.get(self.url, auth=self.auth)
-            try:
-                response.raise_for_status()
-            except Exception as err:
-                new_exc = StashbusError(f"{err} {response.text}")
-                raise new_exc from err
-            else:
-                try:
-                    return self.parse_data(response.text)
-                except ValidationError:
-                    logging.error(
-                        f"The {response} couldn't parsed. Request was {response.request}"
-                    )
-                    raise
+        with timed("fetch"):
+            content = await self.fetch()
+        try:
+            # Decoding and validation are a single pass since the models
+            # validate the raw JSON.
+            with timed("parse"):
+                return self.parse_data(content)
+        except ValidationError:
+            logging.error(f"The response of {self.url} couldn't be parsed.")
+            raise
 
     def get_data(self) -> T:
-        return asyncio.run(self.aget_data())
+        return run_sync(self.aget_data())
+
+    def outputs(self, payload: T) -> Dict[str, Payload]:
+        """The payloads to publish by the name of their output.
+
+        A single unnamed output by default. Data clients fanning a response
+        out to several topics return one payload per output.
+        """
+        return {"": payload}
 
     @abstractmethod
-    def parse_data(self, data: str) -> T:
+    def parse_data(self, data: str | bytes) -> T:
         pass
 
 
+@dataclass
 class Mempool(DataClient[Quote]):
+    """Bitcoin prices, either as one combined quote or fanned out to a
+    quote per currency, from the same single request."""
+
+    fan_out: bool = False
+    currencies: Tuple[str, ...] = tuple(Price.model_fields)
+
     BASEURL = "https://mempool.space/api/v1/prices"
 
     @property
@@ -85,18 +215,26 @@ class Mempool(DataClient[Quote]):
     def url(self):
         return self.BASEURL
 
-    def parse_data(self, data: str) -> Quote:
+    def parse_data(self, data: str | bytes) -> Quote:
         try:
-            mempool_response = MempoolResponse.model_validate_json(data)
-            message = self.model_class(
-                received_at=datetime.now(),
-                price=Price.model_validate(mempool_response.model_dump()),
-            )
-            return message
+            # Validated straight into a Price in one pass, "time" is ignored.
+            price = adapter(MempoolPrice).validate_json(data)
+            return self.model_class(received_at=datetime.now(), price=price)
         except ValidationError as err:
             logging.error(f"Data: {data} couldn't be understood. {err}")
             raise
 
+    def outputs(self, payload: Quote) -> Dict[str, Payload]:
+        if not self.fan_out:
+            return super().outputs(payload)
+        return {
+            currency.lower(): Quote(
+                received_at=payload.received_at,
+                price=Price(**{currency: getattr(payload.price, currency)}),
+            )
+            for currency in self.currencies
+        }
+
 
 @dataclass
 class CryptoCompareClient(DataClient[Quote]):
@@ -116,9 +254,9 @@ class CryptoCompareClient(DataClient[Quote]):
             dict(fsym=self.fsym, tsyms=self.tsym)
         )
 
-    def parse_data(self, data: str) -> Quote:
+    def parse_data(self, data: str | bytes) -> Quote:
         try:
-            price = Price.model_validate_json(data)
+            price = adapter(Price).validate_json(data)
             message = self.model_class(received_at=datetime.now(), price=price)
             return message
         except ValidationError:
@@ -162,35 +300,79 @@ class OWMClient(DataClient[OWMPayload]):
         }
         return self.BASEURL + urllib.parse.urlencode(params)
 
-    def parse_data(self, data: str) -> OWMPayload:
-        return self.model_class(
-            received_at=datetime.now(),
-            **OpenWeatherResponse.model_validate_json(data).current.model_dump(),
-        )
+    def parse_data(self, data: str | bytes) -> OWMPayload:
+        current = adapter(OpenWeatherResponse).validate_json(data).current
+        return self.model_class(received_at=datetime.now(), **vars(current))
 
 
 @dataclass
 class StashRESTClient:
     producer_id: int = field()
     stashrest_url: str = field()
-    http_cli = httpx.AsyncClient()
+    _fleet: CachedResponse | None = field(default=None, init=False, repr=False)
 
     def current_command(self) -> Command:
-        return asyncio.run(self.aiocurrent_command())
+        return run_sync(self.aiocurrent_command())
+
+    def fleet_commands(
+        self, producer_ids: Iterable[int] | None = None
+    ) -> Dict[int, Command]:
+        return run_sync(self.aiofleet_commands(producer_ids))
 
     def secret(self, name: str) -> str:
-        return asyncio.run(self.aiosecret(name))
+        return run_sync(self.aiosecret(name))
 
     async def aiocurrent_command(self) -> Command:
-        req = await self.http_cli.get(
+        req = await HTTP_POOL.client().get(
             f"{self.stashrest_url}/data_producers/{self.producer_id}/"
         )
         return DataProducer.model_validate_json(req.text).command
 
+    async def aiofleet_commands(
+        self, producer_ids: Iterable[int] | None = None
+    ) -> Dict[int, Command]:
+        """Commands of many producers, all of them by default, in one request.
+
+        The ETag of the previous response is sent along, so an unchanged fleet
+        costs a 304 without a body.
+        """
+        url = f"{self.stashrest_url}/data_producers/commands/"
+        if producer_ids is not None:
+            url += "?ids=" + ",".join(str(producer_id) for producer_id in producer_ids)
+        cached = self._fleet if self._fleet and self._fleet.url == url else None
+        response = await HTTP_POOL.client().get(
+            url, headers=cached.headers() if cached else {}
+        )
+        if response.status_code == 304 and cached is not None:
+            content = cached.content
+        else:
+            response.raise_for_status()
+            content = response.content
+            self._fleet = CachedResponse(
+                url, content, response.headers.get("ETag"), None
+            )
+        producers = adapter(Dict[int, DataProducer]).validate_json(content)
+        return {
+            producer_id: producer.command
+            for producer_id, producer in producers.items()
+        }
+
+    def secret_url(self, name: str) -> str:
+        return f"{self.stashrest_url}/secrets/{name}/"
+
+    def subscribe_secret(self, name: str, subscriber: Callable[[str], None]):
+        """Call ``subscriber`` with the new value when the secret is rotated."""
+        SECRETS.subscribe(self.secret_url(name), subscriber)
+
     async def aiosecret(self, name: str) -> str:
-        try:
-            request = await self.http_cli.get(f"{self.stashrest_url}/secrets/{name}/")
+        url = self.secret_url(name)
+
+        async def fetch() -> str:
+            request = await HTTP_POOL.client().get(url)
             return Secret.model_validate_json(request.text).value
+
+        try:
+            return await SECRETS.get(url, fetch)
         except httpx.HTTPError as error:
             logging.error(
                 f"Error while retrieving secret {name}: {error}. Will attempt getting the file-based secret."
@@ -0,0 +1,65 @@
+"""Cached validators of the models for the hot paths.
+
+Building a ``TypeAdapter`` compiles a validator and a serializer, so they
+are built once per type and reused. ``documents`` validates and dumps a
+whole list of documents in one call each instead of a model per document.
+
+With msgspec installed, ``struct_decoder`` decodes JSON straight into the
+``Struct`` twins of the payloads, several times faster than pydantic,
+where the full validation of the models is not needed.
+"""
+
+from datetime import datetime
+from functools import cache
+from typing import Any, Dict, Iterable, List, Optional, Type
+
+from pydantic import BaseModel, TypeAdapter
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None  # type: ignore
+
+Document = Dict[str, Any]
+
+
+@cache
+def adapter(tp: Any) -> TypeAdapter[Any]:
+    return TypeAdapter(tp)
+
+
+def documents(model: Type[BaseModel], docs: Iterable[Document]) -> List[Document]:
+    """Validate ``docs`` as ``model`` and dump them back to dicts."""
+    many = adapter(List[model])  # type: ignore[valid-type]
+    return many.dump_python(many.validate_python(list(docs)))
+
+
+if msgspec is not None:
+
+    class PriceStruct(msgspec.Struct, kw_only=True):
+        USD: Optional[float] = None
+        EUR: Optional[float] = None
+        GBP: Optional[float] = None
+        CAD: Optional[float] = None
+        CHF: Optional[float] = None
+        AUD: Optional[float] = None
+        JPY: Optional[float] = None
+
+    class QuoteStruct(msgspec.Struct, kw_only=True):
+        received_at: datetime
+        price: PriceStruct
+        id: Optional[str] = msgspec.field(name="_id", default=None)
+
+    class OWMPayloadStruct(msgspec.Struct, kw_only=True):
+        received_at: datetime
+        temp: float
+        pressure: float
+        humidity: float
+        wind_speed: float
+        wind_deg: float
+        wind_gust: Optional[float] = None
+        id: Optional[str] = msgspec.field(name="_id", default=None)
+
+    @cache
+    def struct_decoder(struct: type) -> "msgspec.json.Decoder[Any]":
+        return msgspec.json.Decoder(struct)
@@ -0,0 +1,117 @@
+"""Per-message cost of parsing and re-serializing the payload models.
+
+Compares the previous per-model paths with the cached validators of
+``stashbus.models.adapters`` and, when msgspec is installed, its ``Struct``
+twins::
+
+    python -m stashbus.models.bench --number 20000
+"""
+
+import argparse
+import json
+import timeit
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from stashbus.http_common import Mempool, OWMClient
+from stashbus.models import adapters
+from stashbus.models.adapters import documents
+from stashbus.models.mqtt_models import (
+    OpenWeatherResponse,
+    OWMPayload,
+    Price,
+    Quote,
+)
+from stashbus.models.rest_models import MempoolResponse
+
+MEMPOOL = json.dumps(
+    dict(
+        time=1748772000,
+        USD=104000,
+        EUR=91000,
+        GBP=77000,
+        CAD=143000,
+        CHF=85000,
+        AUD=161000,
+        JPY=15000000,
+    )
+).encode()
+
+ONECALL = json.dumps(
+    dict(
+        lat=49.19522,
+        lon=16.60796,
+        current=dict(
+            dt=1748772000,
+            temp=21.5,
+            pressure=1015,
+            humidity=55,
+            wind_speed=3.1,
+            wind_deg=240,
+            clouds=20,
+        ),
+    )
+).encode()
+
+QUOTE_DOC = dict(
+    _id="665b1c2e9f1b2c3d4e5f6a7b",
+    received_at=datetime(2025, 6, 1, 10, 0),
+    price=dict(USD=104000.0, EUR=91000.0),
+)
+
+
+def mempool_before() -> Quote:
+    response = MempoolResponse.model_validate_json(MEMPOOL)
+    return Quote(
+        received_at=datetime.now(),
+        price=Price.model_validate(response.model_dump()),
+    )
+
+
+def owm_before() -> OWMPayload:
+    return OWMPayload(
+        received_at=datetime.now(),
+        **OpenWeatherResponse.model_validate_json(ONECALL).current.model_dump(),
+    )
+
+
+def view_before(docs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [Quote(**doc).model_dump() for doc in docs]
+
+
+def cases(batch: int) -> Dict[str, Callable[[], Any]]:
+    docs = [dict(QUOTE_DOC) for _ in range(batch)]
+    quote = Quote.model_validate(QUOTE_DOC).model_dump_json().encode()
+    mempool = Mempool()
+    owm = OWMClient(49.19522, 16.60796, "appid")
+    result: Dict[str, Callable[[], Any]] = {
+        "mempool parse, before": mempool_before,
+        "mempool parse, after": lambda: mempool.parse_data(MEMPOOL),
+        "owm parse, before": owm_before,
+        "owm parse, after": lambda: owm.parse_data(ONECALL),
+        "quote view, before": lambda: view_before(docs),
+        "quote view, after": lambda: documents(Quote, docs),
+        "quote json, pydantic": lambda: Quote.model_validate_json(quote),
+    }
+    if adapters.msgspec is not None:
+        decoder = adapters.struct_decoder(adapters.QuoteStruct)
+        result["quote json, msgspec"] = lambda: decoder.decode(quote)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument(
+        "--batch", type=int, default=100, help="Documents per view response."
+    )
+    args = parser.parse_args()
+    for name, case in cases(args.batch).items():
+        per_call = min(timeit.repeat(case, number=args.number, repeat=3)) / args.number
+        if name.startswith("quote view"):
+            per_call /= args.batch
+        print(f"{name:>24}: {per_call * 1e6:8.2f} us/message")
+
+
+if __name__ == "__main__":
+    main()
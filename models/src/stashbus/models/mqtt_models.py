@@ -1,7 +1,7 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, SerializeAsAny
 from enum import StrEnum, auto
 from datetime import datetime
-from typing import Optional
+from typing import Any, Generic, List, Literal, Optional, TypeVar
 
 
 class Currency(StrEnum):
@@ -23,6 +23,27 @@ class Payload(BaseModel):
     received_at: datetime
 
 
+P = TypeVar("P", bound=Payload)
+
+ENVELOPE_VERSION = 1
+
+
+class Envelope(BaseModel, Generic[P]):
+    """Several samples of a topic sent in one message, each keeping its own
+    received_at."""
+
+    envelope: Literal[1] = ENVELOPE_VERSION
+    samples: List[SerializeAsAny[P]]
+
+
+def is_envelope(obj: Any) -> bool:
+    return (
+        isinstance(obj, dict)
+        and obj.get("envelope") == ENVELOPE_VERSION
+        and isinstance(obj.get("samples"), list)
+    )
+
+
 class Quote(Payload):
     id: Optional[str] = Field(alias="_id", default=None)  # Mongo ObjectId as string
     price: Price
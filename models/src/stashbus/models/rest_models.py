@@ -1,6 +1,15 @@
 from pydantic import BaseModel, Field
 from enum import StrEnum
 
+from stashbus.models.mqtt_models import Price
+
+CONTROL_TOPIC = "stashbus/control"
+
+
+def producer_control_topic(producer_id: int) -> str:
+    """Topic carrying the retained DataProducer state of a producer."""
+    return f"{CONTROL_TOPIC}/producers/{producer_id}"
+
 
 class Command(StrEnum):
     STOP = "STOP"
@@ -17,6 +26,19 @@ class Secret(BaseModel):
     value: str
 
 
+class MempoolPrice(Price):
+    """The prices of a ``MempoolResponse``, all of them required, validated
+    straight into a ``Price``."""
+
+    USD: float
+    EUR: float
+    GBP: float
+    CAD: float
+    CHF: float
+    AUD: float
+    JPY: float
+
+
 class MempoolResponse(BaseModel):
     time: int
     USD: int
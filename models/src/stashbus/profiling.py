@@ -0,0 +1,85 @@
+"""Sampling profiler switched on and off at runtime by a signal.
+
+A daemon thread samples the stacks of all the other threads every
+``interval`` seconds. When switched off, the samples are written in the
+collapsed format of flamegraph.pl and speedscope, one ``frame;frame count``
+line per distinct stack::
+
+    kill -USR2 <pid>   # start sampling
+    kill -USR2 <pid>   # stop and write stashbus-<pid>-<time>.folded
+"""
+
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import FrameType
+from typing import Any
+
+
+def collapse(frame: FrameType | None) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+        )
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+@dataclass
+class Sampler:
+    directory: Path = Path(".")
+    interval: float = 0.005
+    stacks: Counter[str] = field(default_factory=Counter, init=False)
+    _stopping: threading.Event = field(default_factory=threading.Event, init=False)
+    _thread: threading.Thread | None = field(default=None, init=False)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        self.stacks.clear()
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        logging.info(f"Sampling the stacks every {self.interval}s.")
+
+    def stop(self) -> Path:
+        assert self._thread is not None
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        path = self.directory / f"stashbus-{os.getpid()}-{int(time.time())}.folded"
+        path.write_text(
+            "".join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+        )
+        logging.info(f"Wrote {sum(self.stacks.values())} samples to {path}.")
+        return path
+
+    def toggle(self, *args: Any):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def _sample(self):
+        me = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    self.stacks[collapse(frame)] += 1
+
+    def install(self, signum: int = signal.SIGUSR2):
+        """Toggle the sampler on ``signum``, from the main thread only."""
+        # Created now, a failure in the signal handler would hit whatever
+        # the main thread is running.
+        self.directory.mkdir(parents=True, exist_ok=True)
+        signal.signal(signum, self.toggle)
@@ -0,0 +1,242 @@
+"""Protection of the upstream APIs shared by all the producers of a process.
+
+Every upstream host gets an ``Upstream`` guarding it with an optional token
+bucket and a circuit breaker. The breaker opens after consecutive failures,
+or right away when the upstream answers with ``Retry-After``, and then
+rejects calls without sending them until its exponentially growing timeout
+elapses.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from enum import StrEnum
+from typing import Awaitable, Callable, Dict
+
+import httpx
+
+from stashbus.metrics import REGISTRY
+
+REJECTED = REGISTRY.counter(
+    "stashbus_upstream_rejected_total",
+    "Calls not sent because the upstream circuit was open.",
+    ["host"],
+)
+THROTTLED_SECONDS = REGISTRY.counter(
+    "stashbus_upstream_throttled_seconds_total",
+    "Time spent waiting for the upstream rate limit.",
+    ["host"],
+)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class UpstreamError(Exception):
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"{response.status_code} {response.reason_phrase}")
+        self.response = response
+
+
+@dataclass
+class TokenBucket:
+    """Allows ``rate`` calls per second on average and bursts of ``burst``.
+
+    Callers reserve a token up front and sleep off the debt, so concurrent
+    callers line up without needing a lock bound to an event loop.
+    """
+
+    rate: float
+    burst: float = 1.0
+    _tokens: float = field(init=False)
+    _updated: float | None = field(default=None, init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+
+    def __post_init__(self):
+        self._tokens = self.burst
+
+    def reserve(self, now: float) -> float:
+        """Take a token, returning how long to wait before using it."""
+        with self._lock:
+            if self._updated is not None:
+                elapsed = now - self._updated
+                self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    async def acquire(self) -> float:
+        delay = self.reserve(time.monotonic())
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
+
+
+class CircuitState(StrEnum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+
+@dataclass
+class CircuitBreaker:
+    failure_threshold: int = 5
+    reset_timeout: float = 30.0
+    max_reset_timeout: float = 600.0
+    failures: int = field(default=0, init=False)
+    opened_until: float = field(default=0.0, init=False)
+    _probing: bool = field(default=False, init=False)
+
+    def state(self, now: float) -> CircuitState:
+        if self.opened_until == 0.0:
+            return CircuitState.CLOSED
+        if now < self.opened_until:
+            return CircuitState.OPEN
+        return CircuitState.HALF_OPEN
+
+    def admit(self, now: float) -> CircuitState | None:
+        """The state a call is let through in, None when it is rejected.
+
+        Only one call at a time is let through half-open, as the probe.
+        """
+        state = self.state(now)
+        if state is CircuitState.CLOSED:
+            return state
+        if state is CircuitState.HALF_OPEN and not self._probing:
+            self._probing = True
+            return state
+        return None
+
+    def allow(self, now: float) -> bool:
+        return self.admit(now) is not None
+
+    def success(self):
+        self.failures = 0
+        self.opened_until = 0.0
+        self._probing = False
+
+    def failure(self, now: float, retry_after: float | None = None) -> float:
+        """Record a failure, returning for how long the circuit opens."""
+        self.failures += 1
+        self._probing = False
+        if self.failures < self.failure_threshold:
+            # Below the threshold only the upstream's own Retry-After opens
+            # the circuit, for just as long as it asks.
+            if not retry_after:
+                return 0.0
+            timeout = retry_after
+        else:
+            exponent = self.failures - self.failure_threshold
+            timeout = min(self.max_reset_timeout, self.reset_timeout * 2**exponent)
+            timeout *= random.uniform(0.8, 1.0)
+            timeout = max(timeout, retry_after or 0.0)
+        self.opened_until = now + timeout
+        return timeout
+
+    def release(self):
+        """End a probe whose outcome was not recorded, e.g. a cancelled one."""
+        self._probing = False
+
+
+def retry_after(response: httpx.Response) -> float | None:
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def retryable(response: httpx.Response) -> bool:
+    return response.status_code == 429 or response.status_code >= 500
+
+
+@dataclass
+class Upstream:
+    host: str
+    bucket: TokenBucket | None = None
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+
+    async def call(
+        self, send: Callable[[], Awaitable[httpx.Response]]
+    ) -> httpx.Response:
+        admitted = self.breaker.admit(time.monotonic())
+        if admitted is None:
+            REJECTED.labels(self.host).inc()
+            raise CircuitOpenError(f"The circuit of {self.host} is open.")
+        try:
+            if self.bucket is not None:
+                THROTTLED_SECONDS.labels(self.host).inc(await self.bucket.acquire())
+            try:
+                response = await send()
+            except httpx.TransportError:
+                self.fail(None)
+                raise
+            if retryable(response):
+                self.fail(retry_after(response))
+                raise UpstreamError(response)
+            self.breaker.success()
+            return response
+        finally:
+            if admitted is CircuitState.HALF_OPEN:
+                self.breaker.release()
+
+    def fail(self, delay: float | None):
+        timeout = self.breaker.failure(time.monotonic(), delay)
+        if timeout:
+            logging.warning(f"Not calling {self.host} for {timeout:.1f}s.")
+
+
+@dataclass
+class Upstreams:
+    """The ``Upstream`` of every host, created on first use."""
+
+    default_failure_threshold: int = 5
+    default_reset_timeout: float = 30.0
+    _upstreams: Dict[str, Upstream] = field(default_factory=dict, init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+
+    def get(self, host: str) -> Upstream:
+        with self._lock:
+            upstream = self._upstreams.get(host)
+            if upstream is None:
+                upstream = self._upstreams[host] = Upstream(
+                    host,
+                    breaker=CircuitBreaker(
+                        self.default_failure_threshold, self.default_reset_timeout
+                    ),
+                )
+            return upstream
+
+    def configure(
+        self,
+        host: str,
+        rate: float | None = None,
+        burst: float = 1.0,
+        failure_threshold: int | None = None,
+        reset_timeout: float | None = None,
+        max_reset_timeout: float = 600.0,
+    ) -> Upstream:
+        upstream = self.get(host)
+        upstream.bucket = TokenBucket(rate, burst) if rate else None
+        upstream.breaker = CircuitBreaker(
+            failure_threshold or self.default_failure_threshold,
+            reset_timeout or self.default_reset_timeout,
+            max_reset_timeout,
+        )
+        return upstream
+
+
+UPSTREAMS = Upstreams()
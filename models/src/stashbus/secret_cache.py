@@ -0,0 +1,108 @@
+"""In-process cache of the secrets served by the stashrest web.
+
+A secret younger than ``ttl`` is served without any I/O. An older one is
+still served right away while a background task fetches it again
+(stale-while-revalidate). Only a secret older than ``ttl +
+stale_while_revalidate`` makes the caller wait for the fetch, and if that
+fails, e.g. while the web is down, the stale value keeps being served for
+up to ``stale_if_error``.
+
+Rotated secrets reach the subscribers of ``subscribe``, so the clients
+holding a key can swap it without a restart.
+"""
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Set
+
+from stashbus.metrics import REGISTRY
+
+REFRESH_FAILURES = REGISTRY.counter(
+    "stashbus_secret_refresh_failures_total",
+    "Failed fetches of a secret.",
+    ["name"],
+)
+
+Fetch = Callable[[], Awaitable[str]]
+Subscriber = Callable[[str], None]
+
+
+@dataclass
+class CachedSecret:
+    value: str
+    fetched_at: float
+    fetch: Fetch
+
+
+@dataclass
+class SecretCache:
+    ttl: float = 300.0
+    stale_while_revalidate: float = 300.0
+    stale_if_error: float = 86400.0
+    _entries: Dict[str, CachedSecret] = field(default_factory=dict, init=False)
+    _subscribers: Dict[str, List[Subscriber]] = field(default_factory=dict, init=False)
+    _refreshing: Set["asyncio.Task[None]"] = field(default_factory=set, init=False)
+
+    async def get(self, key: str, fetch: Fetch) -> str:
+        entry = self._entries.get(key)
+        if entry is None:
+            return await self.refresh(key, fetch)
+        age = time.monotonic() - entry.fetched_at
+        if age < self.ttl:
+            return entry.value
+        if age < self.ttl + self.stale_while_revalidate:
+            self.refresh_in_background(key)
+            return entry.value
+        try:
+            return await self.refresh(key, fetch)
+        except Exception as error:
+            if age >= self.ttl + self.stale_if_error:
+                raise
+            logging.warning(f"Serving stale secret {key}: {error}")
+            return entry.value
+
+    async def refresh(self, key: str, fetch: Fetch) -> str:
+        try:
+            value = await fetch()
+        except Exception:
+            REFRESH_FAILURES.labels(key).inc()
+            raise
+        previous = self._entries.get(key)
+        self._entries[key] = CachedSecret(value, time.monotonic(), fetch)
+        if previous is not None and previous.value != value:
+            logging.info(f"Secret {key} changed.")
+            for subscriber in self._subscribers.get(key, []):
+                subscriber(value)
+        return value
+
+    def refresh_in_background(self, key: str):
+        if any(task.get_name() == key for task in self._refreshing):
+            return
+        task = asyncio.create_task(self._refresh_quietly(key), name=key)
+        self._refreshing.add(task)
+        task.add_done_callback(self._refreshing.discard)
+
+    async def _refresh_quietly(self, key: str):
+        try:
+            await self.refresh(key, self._entries[key].fetch)
+        except Exception as error:
+            logging.warning(f"Failed refreshing secret {key}: {error}")
+
+    def subscribe(self, key: str, subscriber: Subscriber):
+        """Call ``subscriber`` with the new value whenever the secret changes."""
+        self._subscribers.setdefault(key, []).append(subscriber)
+
+    async def keep_fresh(self):
+        """Refresh the secrets before they expire, so that the readers never
+        wait for the web, and rotations are noticed even if nobody reads."""
+        while True:
+            await asyncio.sleep(self.ttl / 2)
+            now = time.monotonic()
+            for key, entry in list(self._entries.items()):
+                if now - entry.fetched_at >= self.ttl / 2:
+                    await self._refresh_quietly(key)
+
+    def clear(self):
+        self._entries.clear()
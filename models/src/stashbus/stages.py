@@ -0,0 +1,96 @@
+"""Durations of the stages of the publisher pipeline.
+
+``RESTPublisher`` and ``DataClient`` time their stages (command poll, HTTP
+fetch, parse and validation, change filter, encode, publish) with
+``timed``. The durations go to the sink set by ``set_sink``: Prometheus
+histograms by default, a structured log line, or an in-memory ``StageStats``
+for tests and benchmarks.
+
+The producer label is taken from the ``PRODUCER`` context variable, which
+every publisher sets in its own task.
+"""
+
+import json
+import logging
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Protocol, Tuple
+
+from stashbus.metrics import REGISTRY
+
+PRODUCER: ContextVar[str] = ContextVar("producer", default="")
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "stashbus_publisher_stage_seconds",
+    "Duration of the stages of producing a sample.",
+    ["producer", "stage"],
+)
+
+
+class StageSink(Protocol):
+    def record(self, producer: str, stage: str, seconds: float): ...
+
+
+class PrometheusSink:
+    def record(self, producer: str, stage: str, seconds: float):
+        STAGE_SECONDS.labels(producer, stage).observe(seconds)
+
+
+class LogSink:
+    def __init__(self, logger: logging.Logger = logging.getLogger("stashbus.stages")):
+        self.logger = logger
+
+    def record(self, producer: str, stage: str, seconds: float):
+        self.logger.info(
+            json.dumps({"producer": producer, "stage": stage, "seconds": seconds})
+        )
+
+
+class StageStats:
+    """Keeps every duration in memory."""
+
+    def __init__(self):
+        self.durations: Dict[Tuple[str, str], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, producer: str, stage: str, seconds: float):
+        with self._lock:
+            self.durations.setdefault((producer, stage), []).append(seconds)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                f"{producer}:{stage}": {
+                    "count": len(durations),
+                    "mean": statistics.fmean(durations),
+                    "max": max(durations),
+                }
+                for (producer, stage), durations in self.durations.items()
+            }
+
+
+SINKS = {"prometheus": PrometheusSink, "log": LogSink}
+
+_sink: StageSink | None = PrometheusSink()
+
+
+def set_sink(sink: StageSink | None):
+    """Send the durations to ``sink``, ``None`` stops timing the stages."""
+    global _sink
+    _sink = sink
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    sink = _sink
+    if sink is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        sink.record(PRODUCER.get(), stage, time.perf_counter() - start)
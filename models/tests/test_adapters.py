@@ -0,0 +1,50 @@
+import pytest
+from pydantic import ValidationError
+
+from stashbus.http_common import Mempool, OWMClient
+from stashbus.models import adapters
+from stashbus.models.adapters import adapter, documents
+from stashbus.models.bench import (
+    MEMPOOL,
+    ONECALL,
+    QUOTE_DOC,
+    mempool_before,
+    owm_before,
+)
+from stashbus.models.mqtt_models import Quote
+
+
+def test_adapters_are_cached():
+    assert adapter(Quote) is adapter(Quote)
+
+
+def test_documents_match_per_model_dumps():
+    docs = [dict(QUOTE_DOC), dict(QUOTE_DOC, _id=None)]
+    assert documents(Quote, docs) == [Quote(**doc).model_dump() for doc in docs]
+
+
+def test_parse_data_matches_previous_path():
+    ignored = {"received_at"}
+    assert Mempool().parse_data(MEMPOOL).model_dump(
+        exclude=ignored
+    ) == mempool_before().model_dump(exclude=ignored)
+    assert OWMClient(1, 2, "appid").parse_data(ONECALL).model_dump(
+        exclude=ignored
+    ) == owm_before().model_dump(exclude=ignored)
+
+
+def test_struct_twin():
+    if adapters.msgspec is None:
+        pytest.skip("msgspec is not installed")
+    quote = Quote.model_validate(QUOTE_DOC)
+    decoded = adapters.struct_decoder(adapters.QuoteStruct).decode(
+        quote.model_dump_json(by_alias=True).encode()
+    )
+    assert decoded.id == quote.id
+    assert decoded.received_at == quote.received_at
+    assert decoded.price.USD == quote.price.USD
+
+
+def test_mempool_error_body_raises():
+    with pytest.raises(ValidationError):
+        Mempool().parse_data(b'{"error":"rate limited"}')
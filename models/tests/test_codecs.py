@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import pytest
+
+from stashbus.codecs import BINARY_CODECS, CODECS, CodecSet, get_codec, get_encoder
+
+
+@pytest.mark.parametrize("name", list(CODECS))
+def test_round_trip(name: str):
+    try:
+        codec = get_codec(name)
+    except ImportError:
+        pytest.skip(f"{name} is not installed")
+    obj = {"received_at": datetime(2025, 6, 1, 10), "price": {"USD": 1.5}}
+    assert codec.loads(codec.dumps(obj)) == {
+        "received_at": "2025-06-01T10:00:00",
+        "price": {"USD": 1.5},
+    }
+    assert codec.loads(b'{"a": [1, 2]}') == {"a": [1, 2]}
+
+
+def test_auto_picks_available_codec():
+    assert get_codec().name in CODECS
+
+
+@pytest.mark.parametrize("name", list(BINARY_CODECS))
+def test_binary_round_trip(name: str):
+    try:
+        codec = get_encoder(name)
+    except ImportError:
+        pytest.skip(f"{name} is not installed")
+    obj = {"received_at": datetime(2025, 6, 1, 10), "price": {"USD": 1.5}}
+    data = codec.dumps(obj)
+    assert len(data) < len(get_codec().dumps(obj))
+    assert codec.loads(data) == {
+        "received_at": "2025-06-01T10:00:00",
+        "price": {"USD": 1.5},
+    }
+
+
+def test_codec_set_picks_by_content_type():
+    codecs = CodecSet(get_codec("json"))
+    assert codecs.for_content_type(None).name == "json"
+    assert codecs.for_content_type("application/json; charset=utf-8").name == "json"
+    assert codecs.for_content_type("application/msgpack").name == "msgpack"
+    with pytest.raises(ValueError):
+        codecs.for_content_type("text/plain")
@@ -0,0 +1,76 @@
+import asyncio
+from typing import List
+
+import httpx
+
+from stashbus.http_common import HTTPPool, Mempool, StashRESTClient
+from stashbus.models.rest_models import Command
+
+MEMPOOL = dict(time=1, USD=100000, EUR=90000, GBP=80000, CAD=1, CHF=1, AUD=1, JPY=1)
+
+
+def test_pool_reuses_client_per_loop():
+    pool = HTTPPool()
+
+    async def clients():
+        first, second = pool.client(), pool.client()
+        await pool.aclose()
+        return first, second
+
+    first, second = asyncio.run(clients())
+    assert first is second
+    assert first.is_closed
+    other, _ = asyncio.run(clients())
+    assert other is not first
+
+
+def test_conditional_fetch(monkeypatch):
+    requests: List[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json=MEMPOOL, headers={"ETag": '"v1"'})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(HTTPPool, "client", lambda self: client)
+    mempool = Mempool()
+
+    async def fetch_twice():
+        return await mempool.aget_data(), await mempool.aget_data()
+
+    first, second = asyncio.run(fetch_twice())
+    assert "If-None-Match" not in requests[0].headers
+    assert requests[1].headers["If-None-Match"] == '"v1"'
+    assert first.price == second.price
+    assert second.price.USD == 100000
+
+
+def test_fleet_commands(monkeypatch):
+    requests: List[httpx.Request] = []
+    fleet = {
+        "1": {"name": "a", "command": "STOP"},
+        "2": {"name": "b", "command": "PRODUCE"},
+    }
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("If-None-Match") == '"f1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json=fleet, headers={"ETag": '"f1"'})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(HTTPPool, "client", lambda self: client)
+    stashrest = StashRESTClient(1, "http://web")
+
+    async def refresh_twice():
+        return (
+            await stashrest.aiofleet_commands([1, 2]),
+            await stashrest.aiofleet_commands([1, 2]),
+        )
+
+    first, second = asyncio.run(refresh_twice())
+    assert first == second == {1: Command.STOP, 2: Command.PRODUCE}
+    assert requests[0].url.params["ids"] == "1,2"
+    assert requests[1].headers["If-None-Match"] == '"f1"'
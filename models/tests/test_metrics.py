@@ -0,0 +1,37 @@
+import urllib.request
+
+from stashbus.metrics import Registry, serve
+
+
+def test_render():
+    registry = Registry()
+    registry.counter("messages_total", "Messages.", ["topic"]).labels("a/b").inc(2)
+    registry.gauge("depth", "Depth.").set_function(lambda: 7)
+    histogram = registry.histogram("write_seconds", "Writes.", buckets=[0.1, 1.0])
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    text = registry.render()
+    assert 'messages_total{topic="a/b"} 2.0' in text
+    assert "depth 7" in text
+    assert 'write_seconds_bucket{le="0.1"} 1' in text
+    assert 'write_seconds_bucket{le="1.0"} 2' in text
+    assert 'write_seconds_bucket{le="+Inf"} 3' in text
+    assert "write_seconds_count 3" in text
+
+
+def test_registry_returns_existing_metric():
+    registry = Registry()
+    assert registry.counter("c", "C.") is registry.counter("c", "C.")
+
+
+def test_serve():
+    registry = Registry()
+    registry.counter("served_total", "Served.").inc()
+    server = serve(0, registry=registry)
+    try:
+        port = server.server_address[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as response:
+            assert b"served_total 1.0" in response.read()
+    finally:
+        server.shutdown()
@@ -0,0 +1,130 @@
+import asyncio
+
+import httpx
+import pytest
+
+from stashbus.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    CircuitState,
+    TokenBucket,
+    Upstream,
+    UpstreamError,
+    retry_after,
+)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2.0, burst=2)
+    assert bucket.reserve(0.0) == 0.0
+    assert bucket.reserve(0.0) == 0.0
+    assert bucket.reserve(0.0) == pytest.approx(0.5)
+    assert bucket.reserve(0.0) == pytest.approx(1.0)
+    # The debt is paid off by 1.0, then the bucket refills up to burst.
+    assert bucket.reserve(10.0) == 0.0
+
+
+def test_breaker_opens_after_threshold_and_probes():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10.0)
+    assert breaker.failure(0.0) == 0.0
+    assert breaker.allow(0.0)
+    timeout = breaker.failure(0.0)
+    assert 8.0 <= timeout <= 10.0
+    assert breaker.state(1.0) is CircuitState.OPEN
+    assert not breaker.allow(1.0)
+    assert breaker.state(11.0) is CircuitState.HALF_OPEN
+    assert breaker.allow(11.0)
+    assert not breaker.allow(11.0)
+    # A failed probe doubles the timeout.
+    assert 16.0 <= breaker.failure(11.0) <= 20.0
+    breaker.success()
+    assert breaker.state(11.0) is CircuitState.CLOSED
+
+
+def test_retry_after_opens_immediately():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=1.0)
+    assert breaker.failure(0.0, retry_after=120.0) == 120.0
+    assert not breaker.allow(60.0)
+
+
+def test_retry_after_header():
+    assert retry_after(httpx.Response(429, headers={"Retry-After": "7"})) == 7.0
+    past = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert retry_after(httpx.Response(503, headers={"Retry-After": past})) == 0.0
+    assert retry_after(httpx.Response(503)) is None
+
+
+def test_upstream_rejects_while_open():
+    calls = []
+
+    async def send() -> httpx.Response:
+        calls.append(1)
+        return httpx.Response(429, headers={"Retry-After": "60"})
+
+    upstream = Upstream("api.example.com")
+
+    async def call_twice():
+        with pytest.raises(UpstreamError):
+            await upstream.call(send)
+        with pytest.raises(CircuitOpenError):
+            await upstream.call(send)
+
+    asyncio.run(call_twice())
+    assert len(calls) == 1
+
+
+def test_zero_retry_after_does_not_open():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30.0)
+    assert breaker.failure(0.0, retry_after=0.0) == 0.0
+    assert breaker.state(0.0) is CircuitState.CLOSED
+
+
+def test_cancelled_probe_releases_the_circuit():
+    upstream = Upstream("api.example.com", breaker=CircuitBreaker(1, 10.0))
+
+    async def hang() -> httpx.Response:
+        await asyncio.sleep(60)
+        raise AssertionError
+
+    async def ok() -> httpx.Response:
+        return httpx.Response(200)
+
+    async def scenario():
+        upstream.breaker.failure(0.0)
+        upstream.breaker.opened_until = 0.001
+        probe = asyncio.create_task(upstream.call(hang))
+        await asyncio.sleep(0)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        await upstream.call(ok)
+
+    asyncio.run(scenario())
+    assert upstream.breaker.state(0.0) is CircuitState.CLOSED
+
+
+def test_only_the_probe_releases_the_circuit():
+    upstream = Upstream("api.example.com", breaker=CircuitBreaker(1, 10.0))
+
+    async def hang() -> httpx.Response:
+        await asyncio.sleep(60)
+        raise AssertionError
+
+    async def scenario():
+        earlier = asyncio.create_task(upstream.call(hang))
+        await asyncio.sleep(0)
+        upstream.breaker.failure(0.0)
+        upstream.breaker.opened_until = 0.001
+        probe = asyncio.create_task(upstream.call(hang))
+        await asyncio.sleep(0)
+        # The call let through while closed ends during the probe.
+        earlier.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await earlier
+        with pytest.raises(CircuitOpenError):
+            await upstream.call(hang)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+    asyncio.run(scenario())
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from stashbus import secret_cache
+from stashbus.secret_cache import SecretCache
+
+
+class Web:
+    def __init__(self):
+        self.value = "k1"
+        self.calls = 0
+        self.down = False
+
+    async def fetch(self) -> str:
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("web is down")
+        return self.value
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(secret_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_fresh_secret_is_served_without_fetching(clock):
+    cache, web = SecretCache(ttl=10), Web()
+
+    async def read_twice():
+        return await cache.get("k", web.fetch), await cache.get("k", web.fetch)
+
+    assert asyncio.run(read_twice()) == ("k1", "k1")
+    assert web.calls == 1
+
+
+def test_stale_while_revalidate_notifies_subscribers(clock):
+    cache, web = SecretCache(ttl=10, stale_while_revalidate=10), Web()
+    rotated = []
+    cache.subscribe("k", rotated.append)
+
+    async def scenario():
+        await cache.get("k", web.fetch)
+        web.value = "k2"
+        clock[0] = 15.0
+        stale = await cache.get("k", web.fetch)
+        await asyncio.gather(*cache._refreshing)
+        return stale, await cache.get("k", web.fetch)
+
+    assert asyncio.run(scenario()) == ("k1", "k2")
+    assert rotated == ["k2"]
+    assert web.calls == 2
+
+
+def test_stale_if_error(clock):
+    cache, web = (
+        SecretCache(ttl=10, stale_while_revalidate=0, stale_if_error=100),
+        Web(),
+    )
+    asyncio.run(cache.get("k", web.fetch))
+    web.down = True
+    clock[0] = 50.0
+    assert asyncio.run(cache.get("k", web.fetch)) == "k1"
+    clock[0] = 200.0
+    with pytest.raises(ConnectionError):
+        asyncio.run(cache.get("k", web.fetch))
@@ -0,0 +1,52 @@
+import signal
+import threading
+import time
+
+from stashbus.profiling import Sampler
+from stashbus.stages import PRODUCER, PrometheusSink, StageStats, set_sink, timed
+
+
+def test_timed_records_per_producer():
+    stats = StageStats()
+    set_sink(stats)
+    try:
+        with timed("fetch"):
+            pass
+        PRODUCER.set("stashbus/t")
+        with timed("parse"):
+            time.sleep(0.01)
+    finally:
+        set_sink(PrometheusSink())
+        PRODUCER.set("")
+    assert list(stats.durations) == [("", "fetch"), ("stashbus/t", "parse")]
+    assert stats.summary()["stashbus/t:parse"]["max"] >= 0.01
+
+
+def test_sampler_writes_collapsed_stacks(tmp_path):
+    sampler = Sampler(tmp_path, interval=0.001)
+    done = threading.Event()
+
+    def busy_worker():
+        while not done.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_worker)
+    worker.start()
+    sampler.toggle()
+    time.sleep(0.05)
+    sampler.toggle()
+    done.set()
+    worker.join()
+    (path,) = tmp_path.iterdir()
+    assert "busy_worker" in path.read_text()
+    assert not sampler.running
+
+
+def test_sampler_install_creates_the_directory(tmp_path):
+    sampler = Sampler(tmp_path / "profiles" / "publisher")
+    previous = signal.getsignal(signal.SIGUSR2)
+    try:
+        sampler.install()
+    finally:
+        signal.signal(signal.SIGUSR2, previous)
+    assert sampler.directory.is_dir()
@@ -1,76 +1,242 @@
 from abc import ABC
 
-from typing import TypeVar, Generic, Any, Callable, Dict
+import asyncio
+from typing import TypeVar, Generic, Any, Awaitable, Callable, Dict, List, Sequence, Set
 import paho.mqtt.client as mqtt
 from paho.mqtt.reasoncodes import ReasonCode
 from paho.mqtt.properties import Properties
 from paho.mqtt.enums import CallbackAPIVersion
+from paho.mqtt.packettypes import PacketTypes
+from pydantic import BaseModel
 import logging
-from dataclasses import field, dataclass
-from time import sleep
+from dataclasses import field, dataclass, replace
 import ssl
 import threading
-from stashbus.models.mqtt_models import Payload
+import time
+from stashbus.codecs import Codec
+from stashbus.metrics import REGISTRY
+from stashbus.stages import PRODUCER, timed
+from stashbus.models.mqtt_models import Envelope, Payload
 from stashbus.http_common import (
+    HTTP_POOL,
+    SECRETS,
     DataClient,
     StashRESTClient,
 )
-from stashbus.models.rest_models import Command
+from stashbus.models.rest_models import Command, DataProducer, producer_control_topic
+from stashbus.mqtt_publishers.filters import ChangeFilter
+from stashbus.mqtt_publishers.outbox import Outbox
+from stashbus.mqtt_publishers.scheduler import Deadlines
 
 logging.basicConfig(level=logging.INFO)
 
 
 T = TypeVar("T", bound=Payload)
 
+MessageCallback = Callable[[mqtt.Client, Any, mqtt.MQTTMessage], None]
+
+MISSED_TICKS = REGISTRY.counter(
+    "stashbus_publisher_missed_ticks_total",
+    "Deadlines skipped because the previous tick overran.",
+    ["topic"],
+)
+ACKED = REGISTRY.counter(
+    "stashbus_publisher_acked_total", "Messages acknowledged by the broker."
+)
+PENDING = REGISTRY.gauge(
+    "stashbus_publisher_outbox_pending", "Messages in the outbox, in-flight included."
+)
+INFLIGHT = REGISTRY.gauge(
+    "stashbus_publisher_inflight", "Messages handed to the broker, not acked yet."
+)
+OUTBOX_DROPPED = REGISTRY.gauge(
+    "stashbus_publisher_outbox_dropped", "Messages dropped from the full outbox."
+)
+UNCHANGED = REGISTRY.counter(
+    "stashbus_publisher_unchanged_total",
+    "Samples not published because they did not change.",
+    ["topic"],
+)
+
 
 @dataclass
-class RESTPublisher(ABC, Generic[T]):
+class MQTTConnection:
+    """A paho client shared by all the publishers of a process.
+
+    Published messages go to the outbox first. At most ``max_inflight`` of
+    them are handed to paho, and only while connected, the rest wait in the
+    outbox until acknowledgements or a reconnect make room. A message leaves
+    the outbox when the broker acknowledges it (or, with QoS 0, when it is
+    written to the socket), so with a file backed outbox the messages not
+    acknowledged before a restart are published again after it.
+
+    paho calls ``on_publish`` holding its own lock, so paho is never called
+    while holding ``_lock``, which only guards the bookkeeping below.
+    """
+
     mqtt_host: str = field()
     mqtt_port: int = field()
-    ca_certs: str | None = field()
-    certfile: str | None = field()
-    keyfile: str | None = field()
-    topic: str = field()
-    period: float = field()
-    data_client: DataClient[T] = field()
-    stashrest_client: StashRESTClient = field()
+    ca_certs: str | None = field(default=None)
+    certfile: str | None = field(default=None)
+    keyfile: str | None = field(default=None)
+    qos: int = field(default=1, kw_only=True)
+    max_inflight: int = field(default=20, kw_only=True)
+    outbox: Outbox = field(default_factory=Outbox, kw_only=True)
     mqtt_cli: mqtt.Client = field(init=False)
-    do_work: threading.Event = field(init=False)
+    connected: threading.Event = field(init=False)
+    subscriptions: Dict[str, MessageCallback] = field(init=False)
 
     def __post_init__(self):
+        self.connected = threading.Event()
+        self.subscriptions = {}
+        # paho message id -> outbox id of the messages handed to paho.
+        self._inflight: Dict[int, int] = {}
+        self._early_acks: Set[int] = set()
+        self._sent_upto = 0
+        # _sent_upto before the batch being handed to paho, if any.
+        self._reserved_from: int | None = None
+        # Bumped when the in-flight messages are dropped by rewind().
+        self._generation = 0
+        self._flushing = False
+        self._flush_again = False
+        self._lock = threading.Lock()
         self.init_mqtt_client()
-        self.do_work = threading.Event()
-        self.cmd_map: Dict[Command, Callable[[], None]] = {
-            Command.PRODUCE: self.produce,
-            Command.STOP: self.noop,
-        }
+        PENDING.set_function(lambda: len(self.outbox))
+        INFLIGHT.set_function(lambda: len(self._inflight))
+        OUTBOX_DROPPED.set_function(lambda: self.outbox.dropped)
 
     def init_mqtt_client(self):
         logging.info(f"Starting.")
-        self.mqtt_cli = mqtt.Client(callback_api_version=CallbackAPIVersion.VERSION2)
+        # MQTT v5 to tag the binary payloads with their content type.
+        self.mqtt_cli = mqtt.Client(
+            callback_api_version=CallbackAPIVersion.VERSION2, protocol=mqtt.MQTTv5
+        )
         self.mqtt_cli.on_message = self.on_message
         self.mqtt_cli.on_connect = self.on_connect
         self.mqtt_cli.on_connect_fail = self.on_connect_fail
         self.mqtt_cli.on_socket_close = self.on_socket_close
         self.mqtt_cli.on_publish = self.on_publish
+        self.mqtt_cli.on_subscribe = self.on_subscribe
+        self.mqtt_cli.max_inflight_messages_set(self.max_inflight)
         if self.ca_certs:
             self.mqtt_cli.tls_set(self.ca_certs, certfile=self.certfile, keyfile=self.keyfile, cert_reqs=ssl.CERT_REQUIRED)  # type: ignore
         self.mqtt_cli.connect_async(self.mqtt_host, self.mqtt_port)
 
-    def produce(self):
-        payload = self.data_client.get_data()
-        self.publish(payload)
+    def subscribe(self, topic: str, callback: MessageCallback):
+        """Route the messages of topic to callback, also after reconnects."""
+        self.subscriptions[topic] = callback
+        self.mqtt_cli.message_callback_add(topic, callback)
+        if self.connected.is_set():
+            self.mqtt_cli.subscribe(topic, qos=1)
 
-    def noop(self):
-        pass
+    def send(self, topic: str, payload: bytes, content_type: str | None = None):
+        self.outbox.put(topic, payload, content_type)
+        self.flush()
 
-    def dispatch(self, command: Command) -> Callable[[], None]:
-        action = self.cmd_map[command]
-        return action
+    def flush(self):
+        """Hand messages to paho, in a single thread at a time.
+
+        A flush requested while another thread flushes makes that thread go
+        around once more instead, so no room freed by an ack is left unused.
+        """
+        with self._lock:
+            if not self.connected.is_set():
+                return
+            if self._flushing:
+                self._flush_again = True
+                return
+            self._flushing = True
+        try:
+            while True:
+                while self._flush_batch():
+                    pass
+                with self._lock:
+                    if not self._flush_again:
+                        self._flushing = False
+                        return
+                    self._flush_again = False
+        finally:
+            with self._lock:
+                self._flushing = False
+
+    def _flush_batch(self) -> bool:
+        """Hand messages to paho, returning whether there may be room for more."""
+        with self._lock:
+            room = self.max_inflight - len(self._inflight)
+            if room <= 0 or not self.connected.is_set():
+                return False
+            batch = self.outbox.after(self._sent_upto, room)
+            if not batch:
+                return False
+            previous = self._reserved_from = self._sent_upto
+            generation = self._generation
+            self._sent_upto = batch[-1][0]
+        try:
+            for message_id, topic, payload, content_type in batch:
+                properties = None
+                if content_type is not None:
+                    properties = Properties(PacketTypes.PUBLISH)
+                    properties.ContentType = content_type
+                info = self.mqtt_cli.publish(
+                    topic, payload, qos=self.qos, properties=properties
+                )
+                with self._lock:
+                    if self._generation != generation:
+                        # Rewound meanwhile, the batch is sent again.
+                        return False
+                    if not self.handed(info.rc):
+                        if info.rc != mqtt.MQTT_ERR_NO_CONN:
+                            logging.error(f"Publishing to {topic} failed: {info.rc}.")
+                        self._sent_upto = previous
+                        return False
+                    previous = message_id
+                    if info.mid in self._early_acks:
+                        self._early_acks.discard(info.mid)
+                    else:
+                        self._inflight[info.mid] = message_id
+                        continue
+                self.acked(message_id)
+            with self._lock:
+                return len(self._inflight) < self.max_inflight
+        finally:
+            with self._lock:
+                self._reserved_from = None
+
+    def handed(self, rc: mqtt.MQTTErrorCode) -> bool:
+        """Whether paho took the message over. It queues the QoS 1 and 2
+        messages while offline and retransmits them after reconnects, but
+        not the QoS 0 ones."""
+        if rc == mqtt.MQTT_ERR_NO_CONN:
+            return self.qos > 0
+        return rc == mqtt.MQTT_ERR_SUCCESS
+
+    def rewind(self):
+        """Publish again the QoS 0 messages lost with the last connection."""
+        with self._lock:
+            starts = [message_id - 1 for message_id in self._inflight.values()]
+            if self._reserved_from is not None:
+                starts.append(self._reserved_from)
+            self._sent_upto = min([self._sent_upto, *starts])
+            self._inflight.clear()
+            self._early_acks.clear()
+            self._generation += 1
+
+    def acked(self, message_id: int):
+        self.outbox.remove(message_id)
+        ACKED.inc()
+
+    def start(self):
+        self.mqtt_cli.loop_start()
+
+    def stop(self):
+        self.mqtt_cli.disconnect()
+        self.mqtt_cli.loop_stop()
+        self.outbox.close()
 
-    def publish(self, payload: T):
-        logging.info(f"Publishing {payload}.")
-        self.mqtt_cli.publish(self.topic, payload.model_dump_json())
+    async def wait_connected(self):
+        if not self.connected.is_set():
+            logging.debug("Waiting for the MQTT connection.")
+            await asyncio.to_thread(self.connected.wait)
 
     def on_publish(
         self,
@@ -80,7 +246,15 @@ class RESTPublisher(ABC, Generic[T]):
         reason_code: ReasonCode,
         properties: Properties,
     ):
-        logging.info(f"mid: {mid}.")
+        logging.debug("mid: %d.", mid)
+        with self._lock:
+            message_id = self._inflight.pop(mid, None)
+            if message_id is None:
+                # Acked before flush() got the mid back from publish().
+                self._early_acks.add(mid)
+                return
+        self.acked(message_id)
+        self.flush()
 
     def on_message(self, client: mqtt.Client, userdata: Any, msg: mqtt.MQTTMessage):
         logging.info(f"Received {msg}.")
@@ -104,7 +278,13 @@ class RESTPublisher(ABC, Generic[T]):
         properties: Properties | None,
     ):
         logging.info(f"Connected {self}.")
-        self.do_work.set()
+        if self.subscriptions:
+            client.subscribe([(topic, 1) for topic in self.subscriptions])
+        if self.qos == 0:
+            # paho drops the QoS 0 messages not written before a disconnect.
+            self.rewind()
+        self.connected.set()
+        self.flush()
 
     def on_connect_fail(self, client: mqtt.Client, userdata: Any):
         logging.info(f"Connect failed {self}.")
@@ -113,17 +293,279 @@ class RESTPublisher(ABC, Generic[T]):
         self, client: mqtt.Client, userdata: Any, socket: "mqtt.SocketLike"
     ):
         logging.info(f"Socket {socket} will be closed.")
-        self.do_work.clear()
+        self.connected.clear()
 
-    def run(self):
-        self.mqtt_cli.loop_start()
 
+@dataclass
+class Fleet:
+    """Commands of many producers of a stashrest API, refreshed with one
+    request per period instead of one request per producer and tick."""
+
+    stashrest_client: StashRESTClient
+    producer_ids: List[int]
+    period: float
+    commands: Dict[int, Command] = field(default_factory=dict, init=False)
+
+    async def refresh(self):
+        try:
+            self.commands = await self.stashrest_client.aiofleet_commands(
+                self.producer_ids
+            )
+        except Exception as error:
+            # The publishers poll their own commands until the next refresh.
+            logging.warning(f"Failed refreshing the fleet commands: {error}")
+            self.commands = {}
+
+    async def refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.period)
+            await self.refresh()
+
+
+def fleets(publishers: Sequence["RESTPublisher[Any]"]) -> List[Fleet]:
+    """Group the publishers by their stashrest API into fleets."""
+    groups: Dict[str, List[RESTPublisher[Any]]] = {}
+    for publisher in publishers:
+        groups.setdefault(publisher.stashrest_client.stashrest_url, []).append(
+            publisher
+        )
+    result = []
+    for members in groups.values():
+        fleet = Fleet(
+            members[0].stashrest_client,
+            [member.stashrest_client.producer_id for member in members],
+            min(member.period for member in members),
+        )
+        for member in members:
+            member.fleet = fleet
+        result.append(fleet)
+    return result
+
+
+@dataclass
+class RESTPublisher(ABC, Generic[T]):
+    """Publishes the samples of a data client every period.
+
+    The outputs of a data client with several of them are published to
+    ``topic`` formatted with ``output``, e.g. ``stashbus/prices/btc_{output}``,
+    or to subtopics of ``topic`` when it has no such placeholder.
+    """
+
+    connection: MQTTConnection = field()
+    topic: str = field()
+    period: float = field()
+    data_client: DataClient[T] = field()
+    stashrest_client: StashRESTClient = field()
+    phase: float = field(default=0.0, kw_only=True)
+    jitter: float = field(default=0.0, kw_only=True)
+    change_filter: ChangeFilter | None = field(default=None, kw_only=True)
+    # JSON without a content type when None, for the consumers not
+    # speaking MQTT v5.
+    encoder: Codec | None = field(default=None, kw_only=True)
+    # Samples packed into one message, sent when full or envelope_linger
+    # seconds after its first sample.
+    envelope_size: int = field(default=1, kw_only=True)
+    envelope_linger: float = field(default=60.0, kw_only=True)
+    fleet: Fleet | None = field(default=None, kw_only=True)
+    # Seconds after which a pushed command is checked against the stashrest
+    # API, in case a later push was lost.
+    reconcile_period: float = field(default=300.0, kw_only=True)
+
+    def __post_init__(self):
+        self._envelopes: Dict[str, List[Payload]] = {}
+        self._envelopes_opened: Dict[str, float] = {}
+        self._filters: Dict[str, ChangeFilter] = {}
+        self.cmd_map: Dict[Command, Callable[[], Awaitable[None]]] = {
+            Command.PRODUCE: self.produce,
+            Command.STOP: self.noop,
+        }
+        # Pushed by the web on the control topic. Until the first push
+        # arrives, the command is polled from the stashrest API.
+        self.command: Command | None = None
+        self._pushes = 0
+        self._reconciled_at = time.monotonic()
+        self.connection.subscribe(self.control_topic, self.on_command)
+
+    @property
+    def control_topic(self) -> str:
+        return producer_control_topic(self.stashrest_client.producer_id)
+
+    def on_command(self, client: mqtt.Client, userdata: Any, msg: mqtt.MQTTMessage):
+        if not msg.payload:
+            # The retained command was cleared, fall back to polling.
+            self.command = None
+            return
+        try:
+            self.command = DataProducer.model_validate_json(msg.payload).command
+        except ValueError as exc:
+            logging.error(f"Invalid command on {msg.topic}: {exc}")
+            return
+        self._pushes += 1
+        self._reconciled_at = time.monotonic()
+        logging.info(f"{self.topic}: got command {self.command}.")
+
+    async def current_command(self) -> Command:
+        if self.command is None:
+            return await self.polled_command()
+        if time.monotonic() - self._reconciled_at >= self.reconcile_period:
+            await self.reconcile()
+        return self.command
+
+    async def reconcile(self):
+        pushes = self._pushes
+        self._reconciled_at = time.monotonic()
+        try:
+            command = await self.polled_command()
+        except Exception as error:
+            logging.warning(
+                f"{self.topic}: failed checking the pushed command: {error}"
+            )
+            return
+        if pushes == self._pushes and command != self.command:
+            logging.warning(
+                f"{self.topic}: pushed command {self.command} is stale, "
+                f"the stashrest API has {command}."
+            )
+            self.command = command
+
+    async def polled_command(self) -> Command:
+        if self.fleet is not None:
+            command = self.fleet.commands.get(self.stashrest_client.producer_id)
+            if command is not None:
+                return command
+        return await self.stashrest_client.aiocurrent_command()
+
+    @property
+    def mqtt_cli(self) -> mqtt.Client:
+        return self.connection.mqtt_cli
+
+    def output_topic(self, output: str) -> str:
+        if "{output}" in self.topic:
+            return self.topic.format(output=output)
+        return f"{self.topic}/{output}" if output else self.topic
+
+    def changed(self, topic: str, payload: Payload) -> bool:
+        if self.change_filter is None:
+            return True
+        change_filter = self._filters.get(topic)
+        if change_filter is None:
+            change_filter = self._filters[topic] = replace(self.change_filter)
+        with timed("filter"):
+            publish = change_filter.should_publish(payload.model_dump())
+        if publish:
+            return True
+        logging.debug("%s: unchanged, not publishing.", topic)
+        UNCHANGED.labels(topic).inc()
+        return False
+
+    async def produce(self):
+        payload = await self.data_client.aget_data()
+        for output, sample in self.data_client.outputs(payload).items():
+            topic = self.output_topic(output)
+            if self.changed(topic, sample):
+                self.publish(sample, topic)
+
+    async def noop(self):
+        pass
+
+    def dispatch(self, command: Command) -> Callable[[], Awaitable[None]]:
+        action = self.cmd_map[command]
+        return action
+
+    def publish(self, payload: Payload, topic: str | None = None):
+        topic = topic or self.topic
+        logging.info(f"Publishing {payload} to {topic}.")
+        if self.envelope_size <= 1:
+            self.send(payload, topic)
+            return
+        envelope = self._envelopes.setdefault(topic, [])
+        if not envelope:
+            self._envelopes_opened[topic] = time.monotonic()
+        envelope.append(payload)
+        if len(envelope) >= self.envelope_size:
+            self.flush_envelope(topic)
+
+    def flush_envelope(self, topic: str | None = None):
+        for topic in [topic] if topic else list(self._envelopes):
+            samples = self._envelopes.pop(topic, None)
+            self._envelopes_opened.pop(topic, None)
+            if samples:
+                self.send(Envelope[Payload](samples=samples), topic)
+
+    def send(self, message: BaseModel, topic: str):
+        with timed("encode"):
+            if self.encoder is None:
+                payload, content_type = message.model_dump_json().encode(), None
+            else:
+                payload = self.encoder.dumps(message.model_dump(mode="json"))
+                content_type = self.encoder.content_type
+        with timed("publish"):
+            self.connection.send(topic, payload, content_type)
+
+    async def linger_loop(self):
         while True:
-            logging.debug("Waiting for do_work condition.")
-            self.do_work.wait()
-            try:
-                command = self.stashrest_client.current_command()
-                self.dispatch(command)()
-            except Exception as exc:
-                logging.error(exc)
-            sleep(self.period)
+            await asyncio.sleep(self.envelope_linger / 2)
+            now = time.monotonic()
+            for topic, opened in list(self._envelopes_opened.items()):
+                if now - opened >= self.envelope_linger:
+                    self.flush_envelope(topic)
+
+    async def tick(self):
+        await self.connection.wait_connected()
+        try:
+            with timed("command"):
+                command = await self.current_command()
+            with timed("produce"):
+                await self.dispatch(command)()
+        except Exception as exc:
+            logging.error(f"{self.topic}: {exc}")
+
+    async def serve(self):
+        """Produce every period, on an event loop shared with other publishers.
+
+        A tick is awaited before the next deadline is computed, so the
+        fetches of one producer never overlap.
+        """
+        PRODUCER.set(self.topic)
+        loop = asyncio.get_running_loop()
+        deadlines = Deadlines(self.period, self.phase, self.jitter)
+        deadlines.start(loop.time())
+        lingering = None
+        if self.envelope_size > 1:
+            lingering = asyncio.create_task(self.linger_loop())
+        try:
+            while True:
+                await asyncio.sleep(deadlines.delay(loop.time()))
+                await self.tick()
+                missed = deadlines.advance(loop.time())
+                if missed:
+                    MISSED_TICKS.labels(self.topic).inc(missed)
+                    logging.warning(f"{self.topic}: missed {missed} ticks.")
+        finally:
+            if lingering is not None:
+                lingering.cancel()
+            self.flush_envelope()
+
+    async def arun(self):
+        await run_publishers(self.connection, [self])
+
+    def run(self):
+        asyncio.run(self.arun())
+
+
+async def run_publishers(
+    connection: MQTTConnection, publishers: Sequence[RESTPublisher[Any]]
+):
+    connection.start()
+    workers = [asyncio.create_task(SECRETS.keep_fresh())]
+    if len(publishers) > 1:
+        for fleet in fleets(publishers):
+            await fleet.refresh()
+            workers.append(asyncio.create_task(fleet.refresh_loop()))
+    try:
+        await asyncio.gather(*(publisher.serve() for publisher in publishers))
+    finally:
+        for worker in workers:
+            worker.cancel()
+        await HTTP_POOL.aclose()
+        connection.stop()
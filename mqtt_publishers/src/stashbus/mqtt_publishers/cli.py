@@ -1,11 +1,22 @@
+import asyncio
+from functools import partial
+from pathlib import Path
+
 import click
 from stashbus.http_common import (
+    HTTP_POOL,
     OWMClient,
     StashRESTClient,
     Mempool,
 )
 
-from stashbus.mqtt_publishers import RESTPublisher
+from stashbus.codecs import ENCODINGS, get_encoder
+from stashbus.metrics import serve
+from stashbus.profiling import Sampler
+from stashbus.stages import SINKS, set_sink
+from stashbus.mqtt_publishers import MQTTConnection, RESTPublisher, run_publishers
+from stashbus.mqtt_publishers.outbox import Outbox
+from stashbus.mqtt_publishers.producers import ProducersConfig, build_publishers
 
 BRNO_LAT_LON = 49.19522000, 16.60796000
 
@@ -18,6 +29,34 @@ BRNO_LAT_LON = 49.19522000, 16.60796000
 @click.option("--mqtt_ca_certs", default=None)
 @click.option("--mqtt_certfile", default=None)
 @click.option("--mqtt_keyfile", default=None)
+@click.option("--http2", is_flag=True, help="Talk HTTP/2 to the REST APIs.")
+@click.option("--qos", type=click.IntRange(0, 2), default=1)
+@click.option("--max_inflight", default=20, help="Messages awaiting the broker's ack.")
+@click.option(
+    "--outbox",
+    default=None,
+    help="SQLite file keeping unacknowledged messages across restarts.",
+)
+@click.option("--outbox_max_messages", default=100000)
+@click.option("--metrics_port", type=int, default=None)
+@click.option(
+    "--encoding",
+    type=click.Choice(ENCODINGS),
+    default="json",
+    help="Wire format of the payloads, binary ones need MQTT v5 consumers.",
+)
+@click.option(
+    "--stage_sink",
+    type=click.Choice([*SINKS, "none"]),
+    default="prometheus",
+    help="Where the durations of the pipeline stages go.",
+)
+@click.option(
+    "--profile_dir",
+    type=click.Path(file_okay=False),
+    default=None,
+    help="Toggle a sampling profiler by SIGUSR2, writing its stacks here.",
+)
 @click.pass_context
 def stashbus(
     ctx: click.Context,
@@ -28,7 +67,22 @@ def stashbus(
     mqtt_ca_certs: str | None,
     mqtt_certfile: str | None,
     mqtt_keyfile: str | None,
+    http2: bool,
+    qos: int,
+    max_inflight: int,
+    outbox: str | None,
+    outbox_max_messages: int,
+    metrics_port: int | None,
+    encoding: str,
+    stage_sink: str,
+    profile_dir: str | None,
 ):
+    HTTP_POOL.http2 = http2
+    set_sink(SINKS[stage_sink]() if stage_sink != "none" else None)
+    if profile_dir is not None:
+        Sampler(Path(profile_dir)).install()
+    if metrics_port is not None:
+        serve(metrics_port)
     ctx.ensure_object(dict)
     ctx.obj["mqtt_host"] = mqtt_host
     ctx.obj["mqtt_port"] = mqtt_port
@@ -37,40 +91,83 @@ def stashbus(
     ctx.obj["mqtt_keyfile"] = mqtt_keyfile
     ctx.obj["producer_id"] = producer_id
     ctx.obj["stashrest_url"] = stashrest_url
+    ctx.obj["qos"] = qos
+    ctx.obj["encoder"] = None if encoding == "json" else get_encoder(encoding)
+    ctx.obj["max_inflight"] = max_inflight
+    ctx.obj["outbox"] = outbox
+    ctx.obj["outbox_max_messages"] = outbox_max_messages
 
 
-@stashbus.command()
-@click.pass_context
-def cryptocurrency(ctx: click.Context):
-    stashrest_cli = StashRESTClient(ctx.obj["producer_id"], ctx.obj["stashrest_url"])
-
-    RESTPublisher(
+def mqtt_connection(ctx: click.Context) -> MQTTConnection:
+    return MQTTConnection(
         ctx.obj["mqtt_host"],
         ctx.obj["mqtt_port"],
         ctx.obj["mqtt_ca_certs"],
         ctx.obj["mqtt_certfile"],
         ctx.obj["mqtt_keyfile"],
-        "stashbus/prices/btc_usd",
+        qos=ctx.obj["qos"],
+        max_inflight=ctx.obj["max_inflight"],
+        outbox=Outbox(ctx.obj["outbox"], ctx.obj["outbox_max_messages"]),
+    )
+
+
+@stashbus.command()
+@click.option(
+    "--fan_out",
+    is_flag=True,
+    help="Publish every currency of a fetch to its own btc_<currency> topic.",
+)
+@click.option("--baseurl", default=Mempool.BASEURL, help="URL of the prices API.")
+@click.pass_context
+def cryptocurrency(ctx: click.Context, fan_out: bool, baseurl: str):
+    stashrest_cli = StashRESTClient(ctx.obj["producer_id"], ctx.obj["stashrest_url"])
+    mempool = Mempool(fan_out=fan_out)
+    mempool.BASEURL = baseurl
+
+    RESTPublisher(
+        mqtt_connection(ctx),
+        "stashbus/prices/btc_{output}" if fan_out else "stashbus/prices/btc_usd",
         15.0,
         # CryptoCompareClient(Currency.BTC, Currency.USD, stashrest_cli.secret("coindesk-api-key")),
-        Mempool(),
+        mempool,
         stashrest_cli,
+        encoder=ctx.obj["encoder"],
     ).run()
 
 
 @stashbus.command()
+@click.option("--baseurl", default=OWMClient.BASEURL, help="URL of the One Call API.")
 @click.pass_context
-def weather(ctx: click.Context):
+def weather(ctx: click.Context, baseurl: str):
     stashrest_cli = StashRESTClient(ctx.obj["producer_id"], ctx.obj["stashrest_url"])
+    owm = OWMClient(*BRNO_LAT_LON, stashrest_cli.secret("openweathermap-api-key"))
+    owm.BASEURL = baseurl
+    stashrest_cli.subscribe_secret(
+        "openweathermap-api-key", partial(setattr, owm, "appid")
+    )
 
     RESTPublisher(
-        ctx.obj["mqtt_host"],
-        ctx.obj["mqtt_port"],
-        ctx.obj["mqtt_ca_certs"],
-        ctx.obj["mqtt_certfile"],
-        ctx.obj["mqtt_keyfile"],
+        mqtt_connection(ctx),
         "stashbus/weather/brno",
         60,
-        OWMClient(*BRNO_LAT_LON, stashrest_cli.secret("openweathermap-api-key")),
+        owm,
         stashrest_cli,
+        encoder=ctx.obj["encoder"],
     ).run()
+
+
+@stashbus.command("run-all")
+@click.argument("config", type=click.Path(exists=True, dir_okay=False))
+@click.pass_context
+def run_all(ctx: click.Context, config: str):
+    """Run all the producers of CONFIG over one MQTT connection."""
+    producers_config = ProducersConfig.load(config)
+    producers_config.configure_upstreams()
+    specs = producers_config.producers
+    connection = mqtt_connection(ctx)
+
+    async def main():
+        publishers = await build_publishers(specs, connection, ctx.obj["stashrest_url"])
+        await run_publishers(connection, publishers)
+
+    asyncio.run(main())
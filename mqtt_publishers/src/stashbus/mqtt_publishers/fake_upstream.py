@@ -0,0 +1,155 @@
+"""Offline stand-in for the upstream APIs of the data clients.
+
+Replays the recorded responses of ``fixtures/`` (or of ``--fixtures``, with
+the same file names) for the endpoints of ``Mempool``, ``OWMClient`` and
+``CryptoCompareClient``, with optional latency, 503 errors and 429s with
+``Retry-After``, so that the publishers can be load tested without network
+or API quota. The responses carry an ETag, so conditional fetches get 304s.
+
+The clients are pointed at it by overriding their ``BASEURL``, e.g. with
+``baseurl = "http://localhost:8099/api/v1/prices"`` in a producers config.
+"""
+
+import hashlib
+import random
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from importlib import resources
+from pathlib import Path
+from typing import Dict, Tuple
+
+import click
+
+# Path of the endpoint, fixture file.
+ROUTES = {
+    "/api/v1/prices": "mempool_prices.json",
+    "/data/3.0/onecall": "owm_onecall.json",
+    "/data/price": "cryptocompare_price.json",
+}
+
+Reply = Tuple[int, Dict[str, str], bytes]
+
+
+def load_fixtures(directory: str | None = None) -> Dict[str, bytes]:
+    """The recorded response of every route, from ``directory`` if given."""
+    root = (
+        Path(directory)
+        if directory
+        else resources.files("stashbus.mqtt_publishers") / "fixtures"
+    )
+    return {path: (root / name).read_bytes() for path, name in ROUTES.items()}
+
+
+@dataclass
+class Faults:
+    latency: float = 0.0
+    latency_jitter: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    retry_after: int = 1
+    seed: int | None = None
+    _random: random.Random = field(init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+
+    def __post_init__(self):
+        self._random = random.Random(self.seed)
+
+    def draw(self) -> Tuple[float, float]:
+        """The delay of a response and a number deciding its fault."""
+        with self._lock:
+            jitter = self._random.uniform(0, self.latency_jitter)
+            return self.latency + jitter, self._random.random()
+
+
+@dataclass
+class FakeUpstream:
+    fixtures: Dict[str, bytes]
+    faults: Faults = field(default_factory=Faults)
+    served: Counter[int] = field(default_factory=Counter, init=False)
+
+    def reply(self, path: str, if_none_match: str | None) -> Reply:
+        delay, fault = self.faults.draw()
+        if delay:
+            time.sleep(delay)
+        body = self.fixtures.get(path.split("?")[0])
+        if body is None:
+            return 404, {}, b"Not found"
+        if fault < self.faults.throttle_rate:
+            return 429, {"Retry-After": str(self.faults.retry_after)}, b"Slow down"
+        if fault < self.faults.throttle_rate + self.faults.error_rate:
+            return 503, {}, b"Unavailable"
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if if_none_match == etag:
+            return 304, {"ETag": etag}, b""
+        return 200, {"ETag": etag, "Content-Type": "application/json"}, body
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve from a daemon thread, port 0 picks a free one."""
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                status, headers, body = upstream.reply(
+                    self.path, self.headers.get("If-None-Match")
+                )
+                upstream.served[status] += 1
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+@click.command()
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=8099)
+@click.option(
+    "--fixtures",
+    type=click.Path(exists=True, file_okay=False),
+    help="Directory with recorded responses to replay instead of the shipped ones.",
+)
+@click.option("--latency", default=0.0, help="Seconds added to every response.")
+@click.option("--latency_jitter", default=0.0, help="Up to this many more seconds.")
+@click.option("--error_rate", default=0.0, help="Fraction of 503 responses.")
+@click.option("--throttle_rate", default=0.0, help="Fraction of 429 responses.")
+@click.option("--retry_after", default=1, help="Retry-After of the 429s, seconds.")
+@click.option("--seed", type=int, default=None)
+def fake_upstream_cli(
+    host: str,
+    port: int,
+    fixtures: str | None,
+    latency: float,
+    latency_jitter: float,
+    error_rate: float,
+    throttle_rate: float,
+    retry_after: int,
+    seed: int | None,
+):
+    upstream = FakeUpstream(
+        load_fixtures(fixtures),
+        Faults(latency, latency_jitter, error_rate, throttle_rate, retry_after, seed),
+    )
+    server = upstream.serve(port, host)
+    for path in ROUTES:
+        click.echo(f"Serving http://{host}:{server.server_port}{path}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        click.echo(f"Served responses by status: {dict(upstream.served)}")
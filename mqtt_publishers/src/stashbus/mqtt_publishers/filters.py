@@ -0,0 +1,51 @@
+from dataclasses import dataclass, field
+from numbers import Number
+from typing import Any, Dict, FrozenSet
+
+
+def changed(old: Any, new: Any, deadband: float) -> bool:
+    """Whether new differs from old, ignoring numeric moves within deadband."""
+    if isinstance(old, dict) and isinstance(new, dict):
+        return old.keys() != new.keys() or any(
+            changed(old[key], new[key], deadband) for key in old
+        )
+    if isinstance(old, list) and isinstance(new, list):
+        return len(old) != len(new) or any(
+            changed(a, b, deadband) for a, b in zip(old, new)
+        )
+    if (
+        isinstance(old, Number)
+        and isinstance(new, Number)
+        and not isinstance(old, bool)
+        and not isinstance(new, bool)
+    ):
+        return abs(new - old) > deadband  # type: ignore[operator]
+    return old != new
+
+
+@dataclass
+class ChangeFilter:
+    """Lets through only the samples differing from the last published one.
+
+    Every ``heartbeat``-th sample is published anyway, so that the
+    consumers can tell a steady value from a dead producer.
+    """
+
+    deadband: float = 0.0
+    heartbeat: int = 0
+    ignored: FrozenSet[str] = frozenset({"received_at"})
+    _last: Dict[str, Any] | None = field(default=None, init=False)
+    _since_published: int = field(default=0, init=False)
+
+    def should_publish(self, sample: Dict[str, Any]) -> bool:
+        sample = {k: v for k, v in sample.items() if k not in self.ignored}
+        self._since_published += 1
+        if (
+            self._last is None
+            or changed(self._last, sample, self.deadband)
+            or (self.heartbeat and self._since_published >= self.heartbeat)
+        ):
+            self._last = sample
+            self._since_published = 0
+            return True
+        return False
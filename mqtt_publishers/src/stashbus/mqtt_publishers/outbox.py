@@ -0,0 +1,81 @@
+import sqlite3
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Tuple
+
+Message = Tuple[int, str, bytes, str | None]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    topic TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    content_type TEXT
+)
+"""
+
+
+@dataclass
+class Outbox:
+    """Messages waiting for the broker's acknowledgement.
+
+    Kept in SQLite, so that they survive a restart of the publisher, or only
+    in memory when ``path`` is None. Beyond ``max_messages`` the oldest
+    messages are dropped.
+    """
+
+    path: str | Path | None = None
+    max_messages: int = 100000
+    dropped: int = field(default=0, init=False)
+    _db: sqlite3.Connection = field(init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+
+    def __post_init__(self):
+        self._db = sqlite3.connect(
+            str(self.path) if self.path is not None else ":memory:",
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(SCHEMA)
+        self._length = self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def put(self, topic: str, payload: bytes, content_type: str | None = None) -> int:
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT INTO outbox (topic, payload, content_type) VALUES (?, ?, ?)",
+                (topic, payload, content_type),
+            )
+            self._length += 1
+            overflow = self._length - self.max_messages
+            if overflow > 0:
+                self._db.execute(
+                    "DELETE FROM outbox WHERE id IN "
+                    "(SELECT id FROM outbox ORDER BY id LIMIT ?)",
+                    (overflow,),
+                )
+                self._length -= overflow
+                self.dropped += overflow
+            return cursor.lastrowid  # type: ignore[return-value]
+
+    def after(self, last_id: int, limit: int) -> List[Message]:
+        """The oldest messages with an id greater than last_id."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, topic, payload, content_type FROM outbox "
+                "WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, limit),
+            ).fetchall()
+
+    def remove(self, message_id: int):
+        with self._lock:
+            cursor = self._db.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+            self._length -= cursor.rowcount
+
+    def __len__(self) -> int:
+        return self._length
+
+    def close(self):
+        with self._lock:
+            self._db.close()
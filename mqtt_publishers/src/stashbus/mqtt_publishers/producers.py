@@ -0,0 +1,163 @@
+"""Producers described by a config file, run together by ``stashbus run-all``.
+
+The file is TOML or JSON with a ``producers`` list::
+
+    [[producers]]
+    producer_id = 1
+    topic = "stashbus/weather/brno"
+    period = 60
+    client = "owm"
+    args = {lat = 49.19522, lon = 16.60796}
+    secrets = {appid = "openweathermap-api-key"}
+    jitter = 1.5
+
+``client`` is a key of ``DATA_CLIENTS`` or a ``module:Class`` path. The
+``secrets`` are resolved through the stashrest API and passed to the client
+as keyword arguments together with ``args``. When a secret is rotated, the
+attribute of the client is updated in place. Without an explicit ``phase``,
+the producers get evenly spread ones.
+
+With ``change_only``, a sample is published only when it differs from the
+last published one by more than ``deadband`` in a numeric field, or when
+``heartbeat`` periods have passed since.
+
+``encoding`` is the wire format, ``json`` by default, or ``msgpack`` and
+``cbor`` announced by the MQTT v5 content type.
+
+With ``envelope_size`` above 1, the samples are packed into envelope
+messages of that many samples, sent at the latest ``envelope_linger``
+seconds after their first sample.
+
+``baseurl`` replaces the ``BASEURL`` of the client, e.g. to point it at
+``stashbus-fake-upstream`` for load testing.
+
+The optional ``upstreams`` table rate limits the hosts and tunes their
+circuit breakers, for all the producers calling them::
+
+    [upstreams."api.openweathermap.org"]
+    rate = 0.5
+    burst = 2
+    failure_threshold = 3
+"""
+
+import importlib
+from functools import partial
+import json
+import tomllib
+from pathlib import Path
+from typing import Any, Dict, List, Type
+
+from pydantic import BaseModel
+
+from stashbus.codecs import get_encoder
+from stashbus.http_common import (
+    CryptoCompareClient,
+    DataClient,
+    Mempool,
+    OWMClient,
+    StashRESTClient,
+)
+from stashbus.mqtt_publishers import MQTTConnection, RESTPublisher
+from stashbus.resilience import UPSTREAMS
+from stashbus.mqtt_publishers.filters import ChangeFilter
+from stashbus.mqtt_publishers.scheduler import spread_phases
+
+DATA_CLIENTS: Dict[str, Type[DataClient[Any]]] = {
+    "mempool": Mempool,
+    "owm": OWMClient,
+    "cryptocompare": CryptoCompareClient,
+}
+
+
+def data_client_class(name: str) -> Type[DataClient[Any]]:
+    if name in DATA_CLIENTS:
+        return DATA_CLIENTS[name]
+    module, sep, attr = name.partition(":")
+    if not sep:
+        raise ValueError(f"Unknown data client {name}.")
+    return getattr(importlib.import_module(module), attr)
+
+
+class ProducerSpec(BaseModel):
+    producer_id: int
+    topic: str
+    period: float
+    client: str
+    args: Dict[str, Any] = {}
+    secrets: Dict[str, str] = {}
+    phase: float | None = None
+    jitter: float = 0.0
+    change_only: bool = False
+    deadband: float = 0.0
+    heartbeat: int = 0
+    encoding: str = "json"
+    envelope_size: int = 1
+    envelope_linger: float = 60.0
+    baseurl: str | None = None
+
+
+class UpstreamSpec(BaseModel):
+    rate: float | None = None
+    burst: float = 1.0
+    failure_threshold: int | None = None
+    reset_timeout: float | None = None
+    max_reset_timeout: float = 600.0
+
+
+class ProducersConfig(BaseModel):
+    producers: List[ProducerSpec]
+    upstreams: Dict[str, UpstreamSpec] = {}
+
+    def configure_upstreams(self):
+        for host, spec in self.upstreams.items():
+            UPSTREAMS.configure(host, **spec.model_dump())
+
+    @classmethod
+    def load(cls, path: str | Path) -> "ProducersConfig":
+        path = Path(path)
+        if path.suffix == ".json":
+            return cls.model_validate(json.loads(path.read_text()))
+        with open(path, "rb") as file:
+            return cls.model_validate(tomllib.load(file))
+
+
+async def build_publisher(
+    spec: ProducerSpec,
+    connection: MQTTConnection,
+    stashrest_url: str,
+    phase: float = 0.0,
+) -> RESTPublisher[Any]:
+    stashrest_cli = StashRESTClient(spec.producer_id, stashrest_url)
+    kwargs = dict(spec.args)
+    for arg, secret in spec.secrets.items():
+        kwargs[arg] = await stashrest_cli.aiosecret(secret)
+    data_client = data_client_class(spec.client)(**kwargs)
+    if spec.baseurl is not None:
+        data_client.BASEURL = spec.baseurl
+    for arg, secret in spec.secrets.items():
+        stashrest_cli.subscribe_secret(secret, partial(setattr, data_client, arg))
+    return RESTPublisher(
+        connection,
+        spec.topic,
+        spec.period,
+        data_client,
+        stashrest_cli,
+        phase=spec.phase if spec.phase is not None else phase,
+        jitter=spec.jitter,
+        encoder=None if spec.encoding == "json" else get_encoder(spec.encoding),
+        envelope_size=spec.envelope_size,
+        envelope_linger=spec.envelope_linger,
+        change_filter=(
+            ChangeFilter(spec.deadband, spec.heartbeat) if spec.change_only else None
+        ),
+    )
+
+
+async def build_publishers(
+    specs: List[ProducerSpec], connection: MQTTConnection, stashrest_url: str
+) -> List[RESTPublisher[Any]]:
+    phases = spread_phases([spec.period for spec in specs])
+    return [
+        await build_publisher(spec, connection, stashrest_url, phase)
+        for spec, phase in zip(specs, phases)
+    ]
@@ -0,0 +1,55 @@
+"""Drift-free periodic scheduling of the producers.
+
+The deadlines are absolute, ``start + phase + n * period``, so the time spent
+fetching and publishing does not push the following samples back.
+"""
+
+import random
+from dataclasses import dataclass, field
+from typing import List, Sequence
+
+
+@dataclass
+class Deadlines:
+    """Deadlines every ``period`` seconds of a monotonic clock.
+
+    When a tick overruns, the overdue deadline fires right away, while the
+    deadlines it has completely covered are skipped and counted as missed
+    rather than fired in a burst.
+    """
+
+    period: float
+    phase: float = 0.0
+    jitter: float = 0.0
+    missed: int = field(default=0, init=False)
+    _next: float = field(default=0.0, init=False)
+    _random: random.Random = field(default_factory=random.Random, repr=False)
+
+    def start(self, now: float):
+        self._next = now + self.phase
+
+    @property
+    def next(self) -> float:
+        return self._next
+
+    def delay(self, now: float) -> float:
+        """Seconds to sleep until the next deadline, including the jitter."""
+        jitter = self._random.uniform(0, self.jitter) if self.jitter else 0.0
+        return max(0.0, self._next + jitter - now)
+
+    def advance(self, now: float) -> int:
+        """Move past the fired deadline, returning how many were missed."""
+        self._next += self.period
+        missed = 0
+        if self._next < now:
+            missed = int((now - self._next) // self.period)
+            self._next += missed * self.period
+        self.missed += missed
+        return missed
+
+
+def spread_phases(periods: Sequence[float]) -> List[float]:
+    """Evenly spread phases, so that producers started together do not all
+    hit the upstream APIs at the same moment."""
+    count = len(periods)
+    return [period * index / count for index, period in enumerate(periods)]
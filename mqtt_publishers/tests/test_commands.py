@@ -0,0 +1,153 @@
+import asyncio
+from datetime import datetime
+
+import paho.mqtt.client as mqtt
+
+from stashbus.http_common import Mempool, StashRESTClient
+from stashbus.models.mqtt_models import Envelope, Price, Quote
+from stashbus.models.rest_models import Command
+from stashbus.stages import PrometheusSink, StageStats, set_sink
+from stashbus.mqtt_publishers import MQTTConnection, RESTPublisher, fleets
+
+
+def control_message(payload: bytes) -> mqtt.MQTTMessage:
+    msg = mqtt.MQTTMessage(topic=b"stashbus/control/producers/7")
+    msg.payload = payload
+    return msg
+
+
+def test_pushed_command_replaces_polling(monkeypatch):
+    polled = []
+
+    async def aiocurrent_command(self: StashRESTClient) -> Command:
+        polled.append(self.producer_id)
+        return Command.PRODUCE
+
+    monkeypatch.setattr(StashRESTClient, "aiocurrent_command", aiocurrent_command)
+    connection = MQTTConnection("localhost", 1883)
+    publisher = RESTPublisher(
+        connection, "stashbus/t", 1, Mempool(), StashRESTClient(7, "http://web")
+    )
+    assert "stashbus/control/producers/7" in connection.subscriptions
+
+    assert asyncio.run(publisher.current_command()) is Command.PRODUCE
+    assert polled == [7]
+
+    publisher.on_command(None, None, control_message(b'{"name": "p", "command": "STOP"}'))  # type: ignore[arg-type]
+    assert asyncio.run(publisher.current_command()) is Command.STOP
+    assert polled == [7]
+
+    publisher.on_command(None, None, control_message(b""))  # type: ignore[arg-type]
+    assert asyncio.run(publisher.current_command()) is Command.PRODUCE
+    assert polled == [7, 7]
+
+
+def test_pushed_command_is_reconciled(monkeypatch):
+    async def aiocurrent_command(self: StashRESTClient) -> Command:
+        return Command.PRODUCE
+
+    monkeypatch.setattr(StashRESTClient, "aiocurrent_command", aiocurrent_command)
+    publisher = RESTPublisher(
+        MQTTConnection("localhost", 1883),
+        "stashbus/t",
+        1,
+        Mempool(),
+        StashRESTClient(7, "http://web"),
+        reconcile_period=60,
+    )
+    publisher.on_command(None, None, control_message(b'{"name": "p", "command": "STOP"}'))  # type: ignore[arg-type]
+    assert asyncio.run(publisher.current_command()) is Command.STOP
+
+    # The push changing the command back to PRODUCE was lost.
+    publisher._reconciled_at -= 60
+    assert asyncio.run(publisher.current_command()) is Command.PRODUCE
+    assert publisher.command is Command.PRODUCE
+
+
+def test_envelopes(monkeypatch):
+    connection = MQTTConnection("localhost", 1883)
+    sent = []
+    monkeypatch.setattr(
+        connection,
+        "send",
+        lambda topic, payload, content_type=None: sent.append(payload),
+    )
+    publisher = RESTPublisher(
+        connection,
+        "stashbus/t",
+        1,
+        Mempool(),
+        StashRESTClient(7, "http://web"),
+        envelope_size=2,
+    )
+    samples = [
+        Quote(received_at=datetime(2025, 6, 1, 10, n), price=Price(USD=n))
+        for n in range(3)
+    ]
+    for sample in samples:
+        publisher.publish(sample)
+    assert len(sent) == 1
+    publisher.flush_envelope()
+    envelopes = [Envelope[Quote].model_validate_json(payload) for payload in sent]
+    assert [[s.received_at.minute for s in e.samples] for e in envelopes] == [
+        [0, 1],
+        [2],
+    ]
+
+
+def test_fan_out(monkeypatch):
+    connection = MQTTConnection("localhost", 1883)
+    sent = []
+    monkeypatch.setattr(
+        connection,
+        "send",
+        lambda topic, payload, content_type=None: sent.append((topic, payload)),
+    )
+    mempool = Mempool(fan_out=True, currencies=("USD", "EUR"))
+    quote = Quote(received_at=datetime(2025, 6, 1), price=Price(USD=2, EUR=1))
+
+    async def aget_data() -> Quote:
+        return quote
+
+    monkeypatch.setattr(mempool, "aget_data", aget_data)
+    publisher = RESTPublisher(
+        connection,
+        "stashbus/prices/btc_{output}",
+        1,
+        mempool,
+        StashRESTClient(7, "http://web"),
+    )
+    stats = StageStats()
+    set_sink(stats)
+    try:
+        asyncio.run(publisher.produce())
+    finally:
+        set_sink(PrometheusSink())
+    assert [stage for _, stage in stats.durations] == ["encode", "publish"]
+    topics = {topic: Quote.model_validate_json(payload) for topic, payload in sent}
+    assert list(topics) == ["stashbus/prices/btc_usd", "stashbus/prices/btc_eur"]
+    assert topics["stashbus/prices/btc_usd"].price == Price(USD=2)
+    assert topics["stashbus/prices/btc_eur"].price == Price(EUR=1)
+
+
+def test_fleet_replaces_polling(monkeypatch):
+    async def aiofleet_commands(self: StashRESTClient, producer_ids):
+        return {producer_id: Command.STOP for producer_id in producer_ids}
+
+    monkeypatch.setattr(StashRESTClient, "aiofleet_commands", aiofleet_commands)
+    connection = MQTTConnection("localhost", 1883)
+    publishers = [
+        RESTPublisher(
+            connection,
+            f"stashbus/t{n}",
+            n,
+            Mempool(),
+            StashRESTClient(n, "http://web"),
+        )
+        for n in (1, 2)
+    ]
+    (fleet,) = fleets(publishers)
+    assert fleet.producer_ids == [1, 2]
+    assert fleet.period == 1
+    asyncio.run(fleet.refresh())
+    assert asyncio.run(publishers[1].current_command()) is Command.STOP
@@ -0,0 +1,44 @@
+import pytest
+
+from stashbus.http_common import CryptoCompareClient, Mempool, OWMClient, StashbusError
+from stashbus.models.mqtt_models import Currency
+from stashbus.mqtt_publishers.fake_upstream import FakeUpstream, Faults, load_fixtures
+from stashbus.resilience import UPSTREAMS
+
+
+@pytest.fixture
+def fake():
+    upstream = FakeUpstream(load_fixtures())
+    server = upstream.serve(0)
+    yield upstream, f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_replays_fixtures(fake):
+    upstream, origin = fake
+    UPSTREAMS.configure("127.0.0.1")
+    mempool = Mempool()
+    mempool.BASEURL = f"{origin}/api/v1/prices"
+    owm = OWMClient(49.2, 16.6, "appid")
+    owm.BASEURL = f"{origin}/data/3.0/onecall?"
+    crypto = CryptoCompareClient(Currency.BTC, Currency.USD, "key")
+    crypto.BASEURL = f"{origin}/data/price?"
+
+    assert mempool.get_data().price.EUR == 92139
+    assert mempool.get_data().price.EUR == 92139
+    assert owm.get_data().wind_gust == 6.2
+    assert crypto.get_data().price.USD == 104641.38
+    assert upstream.served == {200: 3, 304: 1}
+
+
+def test_throttles(fake):
+    upstream, origin = fake
+    UPSTREAMS.configure("127.0.0.1")
+    upstream.faults = Faults(throttle_rate=1.0, retry_after=7)
+    mempool = Mempool()
+    mempool.BASEURL = f"{origin}/api/v1/prices"
+    with pytest.raises(StashbusError, match="429"):
+        mempool.get_data()
+    with pytest.raises(StashbusError, match="circuit"):
+        mempool.get_data()
+    assert upstream.served == {429: 1}
@@ -0,0 +1,27 @@
+from stashbus.mqtt_publishers.filters import ChangeFilter, changed
+
+
+def sample(usd: float, at: str = "2025-06-01T10:00:00") -> dict:
+    return {"received_at": at, "price": {"USD": usd, "EUR": None}}
+
+
+def test_changed_deadband():
+    assert not changed({"a": [1.0, 2.0]}, {"a": [1.4, 2.0]}, 0.5)
+    assert changed({"a": [1.0, 2.0]}, {"a": [1.6, 2.0]}, 0.5)
+    assert changed({"a": 1}, {"a": 1, "b": 2}, 0.5)
+    assert changed({"a": True}, {"a": False}, 5)
+    assert changed({"a": None}, {"a": 1.0}, 5)
+
+
+def test_change_filter_ignores_timestamps():
+    change_filter = ChangeFilter(deadband=1.0)
+    assert change_filter.should_publish(sample(100.0))
+    assert not change_filter.should_publish(sample(100.5, "2025-06-01T10:01:00"))
+    # Compared to the last published value, so slow creep is published too.
+    assert change_filter.should_publish(sample(101.1))
+
+
+def test_heartbeat():
+    change_filter = ChangeFilter(heartbeat=3)
+    published = [change_filter.should_publish(sample(100.0)) for _ in range(7)]
+    assert published == [True, False, False, True, False, False, True]
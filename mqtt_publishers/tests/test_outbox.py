@@ -0,0 +1,149 @@
+import threading
+from pathlib import Path
+from typing import List, Tuple
+
+import paho.mqtt.client as mqtt
+from paho.mqtt.properties import Properties
+
+from stashbus.mqtt_publishers import MQTTConnection
+from stashbus.mqtt_publishers.outbox import Outbox
+
+
+def test_outbox_persists(tmp_path: Path):
+    outbox = Outbox(tmp_path / "outbox.sqlite")
+    first = outbox.put("a", b"1")
+    outbox.put("b", b"2")
+    outbox.remove(first)
+    outbox.close()
+
+    reopened = Outbox(tmp_path / "outbox.sqlite")
+    assert len(reopened) == 1
+    assert [(t, p) for _, t, p, _ in reopened.after(0, 10)] == [("b", b"2")]
+
+
+def test_outbox_drops_oldest():
+    outbox = Outbox(max_messages=2)
+    for n in range(3):
+        outbox.put("t", str(n).encode())
+    assert [p for _, _, p, _ in outbox.after(0, 10)] == [b"1", b"2"]
+    assert outbox.dropped == 1
+
+
+class FakeClient:
+    def __init__(self):
+        self.published: List[Tuple[int, str, bytes]] = []
+        self.properties: List[Properties | None] = []
+        self.rc = mqtt.MQTT_ERR_SUCCESS
+
+    def publish(
+        self, topic: str, payload: bytes, qos: int, properties: Properties | None
+    ) -> mqtt.MQTTMessageInfo:
+        info = mqtt.MQTTMessageInfo(len(self.published) + 1)
+        info.rc = self.rc
+        self.published.append((info.mid, topic, payload))
+        self.properties.append(properties)
+        return info
+
+
+def test_inflight_window_and_flush_on_connect():
+    connection = MQTTConnection("localhost", 1883, max_inflight=2)
+    client = FakeClient()
+    connection.mqtt_cli = client  # type: ignore[assignment]
+    for n in range(3):
+        connection.send("t", str(n).encode())
+    assert client.published == []  # not connected yet
+
+    connection.on_connect(client, None, None, None, None)  # type: ignore[arg-type]
+    assert [p for _, _, p in client.published] == [b"0", b"1"]
+
+    connection.on_publish(client, None, 1, None, None)  # type: ignore[arg-type]
+    assert [p for _, _, p in client.published] == [b"0", b"1", b"2"]
+    assert len(connection.outbox) == 2
+
+    connection.on_publish(client, None, 2, None, None)  # type: ignore[arg-type]
+    connection.on_publish(client, None, 3, None, None)  # type: ignore[arg-type]
+    assert len(connection.outbox) == 0
+
+
+def test_content_type_is_published():
+    connection = MQTTConnection("localhost", 1883)
+    client = FakeClient()
+    connection.mqtt_cli = client  # type: ignore[assignment]
+    connection.connected.set()
+    connection.send("t", b"\x80", "application/msgpack")
+    connection.send("t", b"{}")
+    first, second = client.properties
+    assert first is not None and first.ContentType == "application/msgpack"
+    assert second is None
+
+
+class LockingClient(FakeClient):
+    """Takes a lock in publish, like paho's out message mutex which paho also
+    holds while calling on_publish from its network thread."""
+
+    def __init__(self, connection: MQTTConnection):
+        super().__init__()
+        self.connection = connection
+        self.mutex = threading.RLock()
+        self.ack_during_publish: List[int] = []
+        self.network: threading.Thread | None = None
+
+    def publish(
+        self, topic: str, payload: bytes, qos: int, properties: Properties | None
+    ) -> mqtt.MQTTMessageInfo:
+        if self.ack_during_publish:
+            mid = self.ack_during_publish.pop()
+            taken = threading.Event()
+
+            def handle_puback():
+                with self.mutex:
+                    taken.set()
+                    self.connection.on_publish(self, None, mid, None, None)  # type: ignore[arg-type]
+
+            self.network = threading.Thread(target=handle_puback)
+            self.network.start()
+            taken.wait()
+        assert self.mutex.acquire(timeout=2), "deadlocked with on_publish"
+        try:
+            return super().publish(topic, payload, qos, properties)
+        finally:
+            self.mutex.release()
+
+
+def test_puback_during_flush_does_not_deadlock():
+    connection = MQTTConnection("localhost", 1883, max_inflight=3)
+    client = LockingClient(connection)
+    connection.mqtt_cli = client  # type: ignore[assignment]
+    connection.on_connect(client, None, None, None, None)  # type: ignore[arg-type]
+    connection.send("t", b"0")
+    client.ack_during_publish.append(1)
+    connection.send("t", b"1")
+    assert client.network is not None
+    client.network.join(timeout=2)
+    assert [p for _, _, p in client.published] == [b"0", b"1"]
+    assert len(connection.outbox) == 1
+
+
+def test_qos0_messages_lost_offline_are_published_again():
+    connection = MQTTConnection("localhost", 1883, qos=0, max_inflight=2)
+    client = FakeClient()
+    connection.mqtt_cli = client  # type: ignore[assignment]
+    connection.on_connect(client, None, None, None, None)  # type: ignore[arg-type]
+    # Handed to paho, but the connection drops before they are written.
+    connection.send("t", b"0")
+    connection.send("t", b"1")
+    connection.on_socket_close(client, None, None)  # type: ignore[arg-type]
+    connection.on_connect(client, None, None, None, None)  # type: ignore[arg-type]
+    assert [p for _, _, p in client.published] == [b"0", b"1", b"0", b"1"]
+
+    # Not taken over by paho while offline, so they use no window.
+    client.published.clear()
+    client.rc = mqtt.MQTT_ERR_NO_CONN
+    connection.on_publish(client, None, 3, None, None)  # type: ignore[arg-type]
+    connection.on_publish(client, None, 4, None, None)  # type: ignore[arg-type]
+    connection.send("t", b"2")
+    connection.send("t", b"3")
+    assert connection._inflight == {}
+    client.rc = mqtt.MQTT_ERR_SUCCESS
+    connection.on_connect(client, None, None, None, None)  # type: ignore[arg-type]
+    assert [p for _, _, p in client.published[-2:]] == [b"2", b"3"]
@@ -0,0 +1,32 @@
+import asyncio
+from pathlib import Path
+
+from stashbus.http_common import Mempool, OWMClient, StashRESTClient
+from stashbus.mqtt_publishers import MQTTConnection
+from stashbus.mqtt_publishers.producers import ProducersConfig, build_publishers
+
+EXAMPLE = Path(__file__).parent.parent / "producers.example.toml"
+
+
+def test_load_example():
+    config = ProducersConfig.load(EXAMPLE)
+    assert [spec.client for spec in config.producers] == ["owm", "mempool"]
+    assert config.producers[0].secrets == {"appid": "openweathermap-api-key"}
+
+
+def test_build_publishers_share_connection(monkeypatch):
+    async def aiosecret(self: StashRESTClient, name: str) -> str:
+        return f"secret-{name}"
+
+    monkeypatch.setattr(StashRESTClient, "aiosecret", aiosecret)
+    connection = MQTTConnection("localhost", 1883)
+    specs = ProducersConfig.load(EXAMPLE).producers
+
+    weather, crypto = asyncio.run(build_publishers(specs, connection, "http://web"))
+    assert isinstance(weather.data_client, OWMClient)
+    assert weather.data_client.appid == "secret-openweathermap-api-key"
+    assert isinstance(crypto.data_client, Mempool)
+    assert crypto.stashrest_client.producer_id == 2
+    assert weather.mqtt_cli is crypto.mqtt_cli
+    assert (weather.phase, weather.jitter) == (0.0, 1.5)
+    assert crypto.phase == 7.5
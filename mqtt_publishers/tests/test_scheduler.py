@@ -0,0 +1,42 @@
+import random
+
+import pytest
+
+from stashbus.mqtt_publishers.scheduler import Deadlines, spread_phases
+
+
+def test_deadlines_do_not_drift():
+    deadlines = Deadlines(10.0, phase=2.0)
+    deadlines.start(100.0)
+    assert deadlines.delay(100.0) == 2.0
+    # Each tick takes 3s, the deadlines stay anchored at the start.
+    for tick in range(5):
+        now = 102.0 + tick * 10.0 + 3.0
+        assert deadlines.advance(now) == 0
+        assert deadlines.delay(now) == pytest.approx(7.0)
+    assert deadlines.missed == 0
+
+
+def test_overrun_fires_once_and_counts_missed():
+    deadlines = Deadlines(10.0)
+    deadlines.start(0.0)
+    # The first tick took 35s: deadlines 10 and 20 are missed, 30 fires now.
+    assert deadlines.advance(35.0) == 2
+    assert deadlines.next == 30.0
+    assert deadlines.delay(35.0) == 0.0
+    assert deadlines.advance(36.0) == 0
+    assert deadlines.next == 40.0
+    assert deadlines.missed == 2
+
+
+def test_jitter_only_delays():
+    deadlines = Deadlines(10.0, jitter=1.0, _random=random.Random(1))
+    deadlines.start(0.0)
+    delays = [deadlines.delay(0.0) for _ in range(100)]
+    assert all(0.0 <= delay <= 1.0 for delay in delays)
+    assert deadlines.next == 0.0
+
+
+def test_spread_phases():
+    assert spread_phases([60.0, 15.0, 30.0, 60.0]) == [0.0, 3.75, 15.0, 45.0]
+    assert spread_phases([]) == []
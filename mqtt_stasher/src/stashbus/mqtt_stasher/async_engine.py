@@ -0,0 +1,294 @@
+import asyncio
+import logging
+import signal
+import ssl
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Set
+
+import aiomqtt
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
+
+from stashbus.codecs import CodecSet, get_codec
+from stashbus.metrics import REGISTRY, serve
+from stashbus.mqtt_stasher.batching import TopicBatcher
+from stashbus.mqtt_stasher.mqtt_stasher import (
+    BATCHED,
+    DOCUMENTS,
+    MESSAGES,
+    QUEUE_DEPTH,
+    WRITE_FAILURES,
+    WRITE_SECONDS,
+    StashbusSub,
+    only_duplicates,
+)
+from stashbus.mqtt_stasher.receive_queue import Overflow, Received
+from stashbus.mqtt_stasher.storage import (
+    CollectionManager,
+    StorageMode,
+    write_buckets,
+)
+
+RECONNECT_DELAY = 5.0
+
+INFLIGHT = REGISTRY.gauge(
+    "stashbus_stasher_inflight_inserts", "Inserts the async engine waits for."
+)
+
+Document = Dict[str, Any]
+
+
+class AsyncCollectionManager(CollectionManager):
+    """Sets the collections up with the synchronous ``CollectionManager`` on
+    motor's pymongo delegate, in a worker thread like motor's own calls."""
+
+    async def aensure(self, topic: str):
+        if topic not in self._known:
+            await asyncio.to_thread(self.ensure, topic)
+
+
+class PausingQueue(asyncio.Queue[aiomqtt.Message]):
+    """Incoming message queue of ``PausingClient``.
+
+    aiomqtt discards the messages arriving at a full queue, so this one never
+    refuses a message. It calls ``on_full(True)`` once it holds ``maxsize``
+    of them and ``on_full(False)`` when the consumer takes one again.
+    """
+
+    def __init__(self, maxsize: int = 0):
+        super().__init__()
+        self.bound = maxsize
+        self.on_full: Callable[[bool], None] = lambda full: None
+
+    def put_nowait(self, item: aiomqtt.Message):
+        super().put_nowait(item)
+        if self.bound and self.qsize() == self.bound:
+            self.on_full(True)
+
+    def get_nowait(self) -> aiomqtt.Message:
+        item = super().get_nowait()
+        if self.bound and self.qsize() == self.bound - 1:
+            self.on_full(False)
+        return item
+
+
+class PausingClient(aiomqtt.Client):
+    """aiomqtt client which stops reading its socket while the incoming queue
+    holds ``max_queued_incoming_messages``, so that a slow consumer holds the
+    broker back through TCP flow control instead of losing messages.
+
+    Paused longer than the keepalive, the client misses the ping responses
+    and reconnects.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, queue_type=PausingQueue, **kwargs)
+        self._queue.on_full = self.pause  # type: ignore[attr-defined]
+        self._fileno: int | None = None
+        self.paused = False
+
+    def _on_socket_open(self, client: Any, userdata: Any, sock: Any):
+        self._fileno = sock.fileno()
+        super()._on_socket_open(client, userdata, sock)
+
+    def _on_socket_close(self, client: Any, userdata: Any, sock: Any):
+        self._fileno = None
+        super()._on_socket_close(client, userdata, sock)
+
+    def pause(self, full: bool):
+        self.paused = full
+        if self._fileno is None:
+            return
+        if full:
+            self._loop.remove_reader(self._fileno)
+        else:
+            self._loop.add_reader(self._fileno, self._read)
+
+    def _read(self):
+        # Same as aiomqtt's socket reader, which can't be added back once
+        # removed, but stops as soon as the queue is full.
+        try:
+            while not self.paused:
+                self._client.loop_read()
+                sock = self._client._sock
+                if not (hasattr(sock, "pending") and sock.pending() > 0):
+                    break
+        except Exception as exc:
+            if not self._disconnected.done():
+                self._disconnected.set_exception(exc)
+
+
+@dataclass
+class AsyncStashbusSub(StashbusSub):
+    """Stasher engine running MQTT and MongoDB I/O on a single event loop.
+
+    Up to ``max_inflight`` inserts run concurrently. When all of them are
+    busy the message loop stops reading, the incoming queue fills up to
+    ``queue_size`` messages and then the client stops reading its socket,
+    so the backpressure reaches the broker without losing a message.
+    """
+
+    max_inflight: int = 64
+
+    def __post_init__(self):
+        if self.spool_dir is not None or self.overflow is not Overflow.BLOCK:
+            raise ValueError("The async engine supports neither spool nor overflow.")
+        self.mongodb_cli = AsyncIOMotorClient(  # type: ignore[assignment]
+            self.mongodb_url,
+            serverSelectionTimeoutMS=self.mongodb_timeout_ms,
+            timeoutMS=self.mongodb_timeout_ms,
+        )
+        self.db = self.mongodb_cli[self.mongodb_database]
+        self.collections = AsyncCollectionManager(self.db.delegate, self.storage_config)
+        self.codec = get_codec(self.codec_name)
+        self.codecs = CodecSet(self.codec)
+        logging.info(f"Decoding payloads with {self.codec.name}.")
+        if self.batch_size > 1:
+            self.batcher = TopicBatcher(self.batch_size, self.batch_linger)
+        self.inflight = asyncio.Semaphore(self.max_inflight)
+        self.tasks: Set[asyncio.Task[None]] = set()
+        self.client: aiomqtt.Client | None = None
+        self.register_gauges()
+
+    def depth(self) -> int:
+        return len(self.client.messages) if self.client is not None else 0
+
+    def register_gauges(self):
+        QUEUE_DEPTH.set_function(self.depth)
+        INFLIGHT.set_function(lambda: len(self.tasks))
+        if self.batcher is not None:
+            BATCHED.set_function(self.batcher.pending)
+
+    async def ainsert(self, topic: str, docs: List[Document]):
+        logging.debug("Inserting %d documents into %s.", len(docs), topic)
+        start = time.perf_counter()
+        try:
+            await self.awrite(topic, docs)
+        except Exception:
+            WRITE_FAILURES.labels(topic).inc()
+            raise
+        WRITE_SECONDS.observe(time.perf_counter() - start)
+        DOCUMENTS.labels(topic).inc(len(docs))
+
+    async def awrite(self, topic: str, docs: List[Document]):
+        await self.collections.aensure(topic)  # type: ignore[attr-defined]
+        if self.storage_config.mode is StorageMode.BUCKET:
+            await asyncio.to_thread(
+                write_buckets,
+                self.collections.db[topic],
+                self.storage_config,
+                topic,
+                docs,
+            )
+            return
+        try:
+            await self.db[topic].insert_many(docs, ordered=False)
+        except BulkWriteError as exc:
+            if not only_duplicates(exc):
+                raise
+
+    async def astore(self, topic: str, docs: List[Document]):
+        try:
+            await self.ainsert(topic, docs)
+        except Exception as exc:
+            logging.error(f"Failed storing {len(docs)} documents of {topic}: {exc}")
+        finally:
+            self.inflight.release()
+
+    async def submit(self, topic: str, docs: List[Document]):
+        await self.inflight.acquire()
+        task = asyncio.create_task(self.astore(topic, docs))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def handle(self, message: aiomqtt.Message):
+        content_type = getattr(message.properties, "ContentType", None)
+        item = Received(str(message.topic), message.payload, content_type)  # type: ignore[arg-type]
+        if self.is_control(item.topic):
+            return
+        MESSAGES.labels(item.topic).inc()
+        try:
+            docs = self.decode(item)
+        except Exception as exc:
+            logging.error(f"Failed decoding message from {item.topic}: {exc}")
+            return
+        if self.batcher is None:
+            await self.submit(item.topic, docs)
+            return
+        for doc in docs:
+            batch = self.batcher.add(item.topic, doc)
+            if batch:
+                await self.submit(item.topic, batch)
+
+    async def flush_loop(self):
+        assert self.batcher is not None
+        while True:
+            await asyncio.sleep(self.batcher.max_linger / 2)
+            for topic, batch in self.batcher.expired():
+                await self.submit(topic, batch)
+
+    async def stats_loop(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            logging.info(
+                f"Receive queue depth: {self.depth()}, "
+                f"in-flight inserts: {len(self.tasks)}/{self.max_inflight}, "
+                f"batched: {self.batcher.pending() if self.batcher else 0}."
+            )
+
+    async def consume(self):
+        tls_params = None
+        if self.mqtt_ca_certs:
+            tls_params = aiomqtt.TLSParameters(
+                ca_certs=self.mqtt_ca_certs,
+                certfile=self.mqtt_certfile,
+                keyfile=self.mqtt_keyfile,
+                cert_reqs=ssl.CERT_REQUIRED,
+            )
+        while True:
+            try:
+                async with PausingClient(
+                    self.mqtt_host,
+                    self.mqtt_port,
+                    tls_params=tls_params,
+                    protocol=aiomqtt.ProtocolVersion.V5,
+                    max_queued_incoming_messages=self.queue_size,
+                ) as client:
+                    self.client = client
+                    logging.info("Connected.")
+                    await client.subscribe(self.control_topic)
+                    await client.subscribe(self.subscription)
+                    async for message in client.messages:
+                        await self.handle(message)
+            except aiomqtt.MqttError as error:
+                logging.error(
+                    f"MQTT connection lost: {error}. Reconnecting in {RECONNECT_DELAY}s."
+                )
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    async def arun(self):
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stopping.set)
+        if self.metrics_port is not None:
+            serve(self.metrics_port)
+        workers = [
+            asyncio.create_task(self.consume()),
+            asyncio.create_task(self.stats_loop()),
+        ]
+        if self.batcher is not None:
+            workers.append(asyncio.create_task(self.flush_loop()))
+        await stopping.wait()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        if self.batcher is not None:
+            for topic, batch in self.batcher.drain():
+                await self.submit(topic, batch)
+        await asyncio.gather(*self.tasks)
+        self.mongodb_cli.close()
+
+    def run(self):
+        asyncio.run(self.arun())
@@ -0,0 +1,55 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+Document = Dict[str, Any]
+Batch = Tuple[str, List[Document]]
+
+
+@dataclass
+class TopicBatcher:
+    """Groups documents per topic until a size or an age limit is reached.
+
+    The batcher does no I/O. It only hands the ready batches back to the
+    caller, which is responsible for writing them.
+    """
+
+    max_size: int
+    max_linger: float
+    _pending: Dict[str, List[Document]] = field(default_factory=dict, init=False)
+    _opened_at: Dict[str, float] = field(default_factory=dict, init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+
+    def add(self, topic: str, doc: Document) -> List[Document] | None:
+        with self._lock:
+            batch = self._pending.setdefault(topic, [])
+            if not batch:
+                self._opened_at[topic] = time.monotonic()
+            batch.append(doc)
+            if len(batch) >= self.max_size:
+                return self._take(topic)
+        return None
+
+    def expired(self, now: float | None = None) -> List[Batch]:
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            topics = [
+                topic
+                for topic, opened_at in self._opened_at.items()
+                if now - opened_at >= self.max_linger
+            ]
+            return [(topic, self._take(topic)) for topic in topics]
+
+    def drain(self) -> List[Batch]:
+        with self._lock:
+            return [(topic, self._take(topic)) for topic in list(self._pending)]
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(batch) for batch in self._pending.values())
+
+    def _take(self, topic: str) -> List[Document]:
+        self._opened_at.pop(topic, None)
+        return self._pending.pop(topic)
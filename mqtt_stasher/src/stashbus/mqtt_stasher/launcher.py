@@ -0,0 +1,70 @@
+import logging
+import multiprocessing
+import signal
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List
+
+if TYPE_CHECKING:
+    from stashbus.mqtt_stasher.mqtt_stasher import Engine
+
+RESTART_DELAY = 5.0
+
+
+def worker_kwargs(kwargs: Dict[str, Any], index: int) -> Dict[str, Any]:
+    kwargs = dict(kwargs)
+    if kwargs.get("spool_dir"):
+        # Every worker replays its own spool, they must not share segments.
+        kwargs["spool_dir"] = str(Path(kwargs["spool_dir"]) / f"worker-{index}")
+    if kwargs.get("metrics_port") is not None:
+        kwargs["metrics_port"] += index
+    return kwargs
+
+
+def run_worker(engine: "Engine", kwargs: Dict[str, Any]):
+    from stashbus.mqtt_stasher.mqtt_stasher import subscriber_class
+
+    subscriber_class(engine)(**kwargs).run()
+
+
+def run_workers(processes: int, engine: "Engine", kwargs: Dict[str, Any]):
+    """Run ``processes`` stasher workers and restart the ones which die.
+
+    The workers are expected to share the MQTT subscription, otherwise every
+    message would be stored by each of them.
+    """
+    stopping = threading.Event()
+    workers: List[multiprocessing.Process | None] = [None] * processes
+
+    def start(index: int) -> multiprocessing.Process:
+        process = multiprocessing.Process(
+            target=run_worker,
+            args=(engine, worker_kwargs(kwargs, index)),
+            name=f"stasher-worker-{index}",
+        )
+        process.start()
+        logging.info(f"Started {process.name} with pid {process.pid}.")
+        return process
+
+    def stop(signum: int, frame: Any):
+        stopping.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(processes):
+        workers[index] = start(index)
+
+    while not stopping.wait(RESTART_DELAY):
+        for index, process in enumerate(workers):
+            if process is not None and not process.is_alive():
+                logging.error(
+                    f"{process.name} exited with {process.exitcode}, restarting."
+                )
+                workers[index] = start(index)
+
+    for process in workers:
+        if process is not None and process.pid is not None:
+            process.terminate()
+    for process in workers:
+        if process is not None:
+            process.join()
@@ -0,0 +1,75 @@
+import logging
+import queue
+from dataclasses import dataclass, field
+from enum import StrEnum
+from typing import Callable
+
+
+class Overflow(StrEnum):
+    BLOCK = "block"
+    DROP_OLDEST = "drop_oldest"
+    SPILL = "spill"
+
+
+@dataclass
+class Received:
+    topic: str
+    payload: bytes
+    content_type: str | None = None
+
+
+@dataclass
+class ReceiveQueue:
+    """Bounded hand-over between the MQTT network thread and the writers."""
+
+    maxsize: int
+    overflow: Overflow = Overflow.BLOCK
+    spill: Callable[[Received], None] | None = None
+    dropped: int = field(default=0, init=False)
+    spilled: int = field(default=0, init=False)
+    high_watermark: int = field(default=0, init=False)
+
+    def __post_init__(self):
+        if self.overflow is Overflow.SPILL and self.spill is None:
+            raise ValueError("Overflow.SPILL requires a spill callback.")
+        self._queue: queue.Queue[Received] = queue.Queue(self.maxsize)
+
+    def put(self, item: Received):
+        match self.overflow:
+            case Overflow.BLOCK:
+                self._queue.put(item)
+            case Overflow.DROP_OLDEST:
+                while True:
+                    try:
+                        self._queue.put_nowait(item)
+                        break
+                    except queue.Full:
+                        self._drop_oldest()
+            case Overflow.SPILL:
+                try:
+                    self._queue.put_nowait(item)
+                except queue.Full:
+                    assert self.spill is not None
+                    self.spill(item)
+                    self.spilled += 1
+        self.high_watermark = max(self.high_watermark, self._queue.qsize())
+
+    def get(self, timeout: float) -> Received | None:
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def empty(self) -> bool:
+        return self._queue.empty()
+
+    def _drop_oldest(self):
+        try:
+            dropped = self._queue.get_nowait()
+        except queue.Empty:
+            return
+        self.dropped += 1
+        logging.debug("Receive queue full, dropped message from %s.", dropped.topic)
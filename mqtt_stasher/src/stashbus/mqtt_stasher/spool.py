@@ -0,0 +1,177 @@
+import logging
+import os
+import struct
+import threading
+import time
+from dataclasses import dataclass, field
+from enum import StrEnum
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple
+
+import bson
+from bson.errors import InvalidBSON
+
+Document = Dict[str, Any]
+
+SEGMENT_SUFFIX = ".seg"
+TORN_SUFFIX = ".torn"
+
+
+class FsyncPolicy(StrEnum):
+    ALWAYS = "always"
+    INTERVAL = "interval"
+    NEVER = "never"
+
+
+@dataclass
+class Spool:
+    """Append-only, segment based local storage of not yet stored documents.
+
+    Records are appended to the active segment. Once the active segment grows
+    over ``segment_size`` a new one is started. Sealed segments are handed to
+    the replayer oldest first, so the documents reach MongoDB in the order
+    they were spooled. When the spool would grow over ``max_bytes`` the oldest
+    segments are discarded.
+
+    A record torn by a crash ends the segment it is in: the bytes from it on
+    are moved aside to a ``.torn`` file and the records before it replayed.
+
+    Replaying is idempotent in the plain storage mode only, where every
+    document carries its ``_id`` and the ones stored before a failed replay
+    are skipped as duplicates. Time-series and bucket collections have no
+    unique key, so a segment replayed again after a partial failure stores
+    its documents again.
+    """
+
+    directory: Path
+    segment_size: int = 16 * 1024 * 1024
+    max_bytes: int = 1024 * 1024 * 1024
+    fsync: FsyncPolicy = FsyncPolicy.INTERVAL
+    fsync_interval: float = 1.0
+    discarded_segments: int = field(default=0, init=False)
+    torn_records: int = field(default=0, init=False)
+
+    def __post_init__(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._sealed: List[Path] = sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}"))
+        self._sealed = [path for path in self._sealed if path.stat().st_size]
+        self._bytes = sum(path.stat().st_size for path in self._sealed)
+        last_seq = int(self._sealed[-1].stem) if self._sealed else 0
+        self._open_segment(last_seq + 1)
+        if self._sealed:
+            logging.info(
+                f"Spool {self.directory} holds {len(self._sealed)} segments to replay."
+            )
+
+    def append(self, topic: str, docs: List[Document]):
+        record = bson.encode({"topic": topic, "docs": docs})
+        with self._lock:
+            self._active.write(record)
+            self._active_size += len(record)
+            self._bytes += len(record)
+            self._sync()
+            if self._active_size >= self.segment_size:
+                self._seal()
+            self._enforce_limit()
+
+    def empty(self) -> bool:
+        with self._lock:
+            return not self._sealed and not self._active_size
+
+    def size(self) -> int:
+        with self._lock:
+            return self._bytes
+
+    def oldest(self) -> Path | None:
+        """Return the oldest segment, sealing the active one when needed."""
+        with self._lock:
+            if not self._sealed and self._active_size:
+                self._seal()
+            return self._sealed[0] if self._sealed else None
+
+    def read(self, segment: Path) -> Iterator[Tuple[str, List[Document]]]:
+        with open(segment, "rb") as file:
+            while True:
+                offset = file.tell()
+                header = file.read(4)
+                if not header:
+                    return
+                try:
+                    if len(header) < 4:
+                        raise InvalidBSON("truncated record size")
+                    (size,) = struct.unpack("<i", header)
+                    if size < 5:
+                        raise InvalidBSON(f"invalid record size {size}")
+                    data = header + file.read(size - 4)
+                    if len(data) != size:
+                        raise InvalidBSON(f"truncated record of {size} bytes")
+                    record = bson.decode(data)
+                except InvalidBSON as exc:
+                    self._quarantine(segment, offset, exc)
+                    return
+                yield record["topic"], record["docs"]
+
+    def remove(self, segment: Path):
+        with self._lock:
+            if segment in self._sealed:
+                self._sealed.remove(segment)
+                self._bytes -= segment.stat().st_size
+                segment.unlink()
+
+    def close(self):
+        with self._lock:
+            self._active.flush()
+            os.fsync(self._active.fileno())
+            self._active.close()
+            if not self._active_size:
+                self._active_path.unlink()
+
+    def _quarantine(self, segment: Path, offset: int, exc: InvalidBSON):
+        torn = segment.with_suffix(TORN_SUFFIX)
+        with open(segment, "rb") as file:
+            file.seek(offset)
+            torn.write_bytes(file.read())
+        self.torn_records += 1
+        logging.error(
+            f"Spool segment {segment.name} is torn at byte {offset}, "
+            f"moved its tail to {torn.name}: {exc}"
+        )
+
+    def _open_segment(self, seq: int):
+        self._seq = seq
+        self._active_path = self.directory / f"{seq:012d}{SEGMENT_SUFFIX}"
+        self._active: BinaryIO = open(self._active_path, "ab")
+        self._active_size = 0
+        self._synced_at = time.monotonic()
+
+    def _sync(self):
+        self._active.flush()
+        match self.fsync:
+            case FsyncPolicy.ALWAYS:
+                os.fsync(self._active.fileno())
+            case FsyncPolicy.INTERVAL:
+                now = time.monotonic()
+                if now - self._synced_at >= self.fsync_interval:
+                    os.fsync(self._active.fileno())
+                    self._synced_at = now
+
+    def _seal(self):
+        self._active.flush()
+        if self.fsync is not FsyncPolicy.NEVER:
+            os.fsync(self._active.fileno())
+        self._active.close()
+        self._sealed.append(self._active_path)
+        self._open_segment(self._seq + 1)
+
+    def _enforce_limit(self):
+        while self._bytes > self.max_bytes and self._sealed:
+            segment = self._sealed.pop(0)
+            size = segment.stat().st_size
+            self._bytes -= size
+            segment.unlink()
+            self.discarded_segments += 1
+            logging.error(
+                f"Spool {self.directory} is over {self.max_bytes} bytes, "
+                f"discarded segment {segment.name} of {size} bytes."
+            )
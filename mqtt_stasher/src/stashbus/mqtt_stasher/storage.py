@@ -0,0 +1,223 @@
+import logging
+import threading
+import tomllib
+from dataclasses import dataclass, field
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from enum import StrEnum
+from typing import Any, Dict, Iterator, List, Literal, Set, Tuple
+
+from bson import ObjectId
+from paho.mqtt.client import topic_matches_sub
+from pydantic import BaseModel, Field
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import CollectionInvalid, DuplicateKeyError
+
+Document = Dict[str, Any]
+
+
+class StorageMode(StrEnum):
+    PLAIN = "plain"
+    TIMESERIES = "timeseries"
+    BUCKET = "bucket"
+
+
+class IndexSpec(BaseModel):
+    topic: str = Field(description="MQTT topic filter the index applies to.")
+    keys: List[Tuple[str, Literal[1, -1]]]
+    name: str | None = None
+
+
+class StorageConfig(BaseModel):
+    mode: StorageMode = StorageMode.PLAIN
+    time_field: str = "received_at"
+    meta_field: str = "meta"
+    granularity: Literal["seconds", "minutes", "hours"] = "seconds"
+    expire_after_seconds: int | None = None
+    bucket_seconds: int = 60
+    bucket_max_samples: int = 1000
+    indexes: List[IndexSpec] = Field(default_factory=list)
+
+    @classmethod
+    def load(cls, path: str) -> "StorageConfig":
+        with open(path, "rb") as file:
+            return cls.model_validate(tomllib.load(file))
+
+    def timeseries_options(self) -> Dict[str, Any]:
+        options: Dict[str, Any] = {
+            "timeseries": {
+                "timeField": self.time_field,
+                "metaField": self.meta_field,
+                "granularity": self.granularity,
+            }
+        }
+        if self.expire_after_seconds is not None:
+            options["expireAfterSeconds"] = self.expire_after_seconds
+        return options
+
+    def indexes_for(self, topic: str) -> List[IndexSpec]:
+        return [
+            index for index in self.indexes if topic_matches_sub(index.topic, topic)
+        ]
+
+
+def parse_timestamp(value: Any) -> datetime:
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return datetime.now(timezone.utc)
+
+
+def window_start(timestamp: datetime, seconds: int) -> datetime:
+    epoch = datetime(1970, 1, 1, tzinfo=timestamp.tzinfo)
+    window = timedelta(seconds=seconds)
+    return epoch + (timestamp - epoch) // window * window
+
+
+def numeric_fields(doc: Document, prefix: str = "") -> Iterator[Tuple[str, float]]:
+    for key, value in doc.items():
+        if isinstance(value, bool) or key.startswith("_"):
+            continue
+        if isinstance(value, (int, float)):
+            yield prefix + key, value
+        elif isinstance(value, dict):
+            yield from numeric_fields(value, f"{prefix}{key}.")
+
+
+def windows(
+    config: StorageConfig, docs: List[Document]
+) -> Dict[datetime, List[Document]]:
+    result: Dict[datetime, List[Document]] = defaultdict(list)
+    for doc in docs:
+        result[window_start(doc[config.time_field], config.bucket_seconds)].append(doc)
+    return result
+
+
+def bucket_update(
+    config: StorageConfig, topic: str, start: datetime, samples: List[Document]
+) -> Document:
+    """Update appending the samples to a bucket of their window.
+
+    A bucket holds the samples of one ``bucket_seconds`` long window together
+    with their count and the min/max of every numeric field.
+    """
+    minimum: Dict[str, Any] = {}
+    maximum: Dict[str, Any] = {}
+    for sample in samples:
+        for name, value in numeric_fields(sample):
+            minimum[name] = min(value, minimum.get(name, value))
+            maximum[name] = max(value, maximum.get(name, value))
+    times = [sample[config.time_field] for sample in samples]
+    return {
+        "$push": {"samples": {"$each": samples}},
+        "$inc": {"count": len(samples)},
+        "$min": {
+            "first_at": min(times),
+            **{f"min.{name}": value for name, value in minimum.items()},
+        },
+        "$max": {
+            "last_at": max(times),
+            **{f"max.{name}": value for name, value in maximum.items()},
+        },
+        "$setOnInsert": {
+            "window_end": start + timedelta(seconds=config.bucket_seconds),
+            config.meta_field: {"topic": topic},
+        },
+    }
+
+
+def write_buckets(
+    collection: Collection[Document],
+    config: StorageConfig,
+    topic: str,
+    docs: List[Document],
+):
+    """Append the samples to the buckets of their windows.
+
+    The buckets of a window are numbered by ``seq``, unique together with
+    ``window_start``. The samples are first offered to a bucket with room for
+    all of them; when it has less, the bucket is read and filled up exactly
+    and the rest goes to the next one. A bucket created or grown by another
+    writer in between fails the upsert with a duplicate key, which is retried
+    with the bucket read again.
+    """
+    limit = config.bucket_max_samples
+    for start, samples in windows(config, docs).items():
+        seq, count = 0, None
+        while samples:
+            if count is None:
+                chunk = samples[:limit]
+                room: Dict[str, Any] = {"$lte": limit - len(chunk)}
+            else:
+                chunk = samples[: limit - count]
+                room = {"$eq": count}
+            if not chunk:
+                seq, count = seq + 1, None
+                continue
+            try:
+                collection.update_one(
+                    {"window_start": start, "seq": seq, "count": room},
+                    bucket_update(config, topic, start, chunk),
+                    upsert=True,
+                )
+            except DuplicateKeyError:
+                bucket = collection.find_one(
+                    {"window_start": start, "seq": seq}, {"count": 1}
+                )
+                if bucket is None:
+                    raise
+                count = bucket["count"]
+                continue
+            samples = samples[len(chunk) :]
+            seq, count = seq + 1, None
+
+
+@dataclass
+class CollectionManager:
+    """Sets up a topic's collection the first time the topic is seen."""
+
+    db: Database[Document]
+    config: StorageConfig
+    _known: Set[str] = field(default_factory=set, init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+
+    def prepare(self, topic: str, doc: Document) -> Document:
+        if self.config.mode is not StorageMode.BUCKET:
+            # Set before the first write and the spool, so that a retried or
+            # replayed insert reports the stored documents as duplicates.
+            doc.setdefault("_id", ObjectId())
+        if self.config.mode is not StorageMode.PLAIN:
+            doc[self.config.time_field] = parse_timestamp(
+                doc.get(self.config.time_field)
+            )
+        if self.config.mode is StorageMode.TIMESERIES:
+            doc[self.config.meta_field] = {"topic": topic}
+        return doc
+
+    def ensure(self, topic: str):
+        if topic in self._known:
+            return
+        with self._lock:
+            if topic in self._known:
+                return
+            if self.config.mode is StorageMode.TIMESERIES:
+                self._create_timeseries(topic)
+            if self.config.mode is StorageMode.BUCKET:
+                self.db[topic].create_index(
+                    [("window_start", -1), ("seq", 1)], unique=True
+                )
+            for index in self.config.indexes_for(topic):
+                self.db[topic].create_index(index.keys, name=index.name)
+            self._known.add(topic)
+
+    def _create_timeseries(self, topic: str):
+        try:
+            self.db.create_collection(topic, **self.config.timeseries_options())
+            logging.info(f"Created time-series collection {topic}.")
+        except CollectionInvalid:
+            if "timeseries" not in self.db[topic].options():
+                logging.warning(
+                    f"Collection {topic} already exists and is not a time-series one."
+                )
@@ -0,0 +1,56 @@
+import asyncio
+import socket
+from typing import List
+
+import aiomqtt
+
+from stashbus.mqtt_stasher.async_engine import PausingClient, PausingQueue
+
+
+def publish_packet(topic: bytes, payload: bytes) -> bytes:
+    # MQTT v5 PUBLISH, QoS 0, no properties.
+    body = len(topic).to_bytes(2, "big") + topic + b"\x00" + payload
+    return bytes([0x30, len(body)]) + body
+
+
+def test_pausing_queue_never_refuses():
+    async def fill() -> List[bool]:
+        signals: List[bool] = []
+        queue = PausingQueue(2)
+        queue.on_full = signals.append
+        for n in range(3):
+            queue.put_nowait(n)  # type: ignore[arg-type]
+        assert queue.qsize() == 3
+        await queue.get()
+        await queue.get()
+        return signals
+
+    assert asyncio.run(fill()) == [True, False]
+
+
+def test_slow_consumer_loses_nothing():
+    async def consume() -> List[int]:
+        client = PausingClient(
+            "localhost",
+            protocol=aiomqtt.ProtocolVersion.V5,
+            max_queued_incoming_messages=3,
+        )
+        ours, broker = socket.socketpair()
+        ours.setblocking(False)
+        client._client._sock = ours  # type: ignore[assignment]
+        client._on_socket_open(client._client, None, ours)
+        for n in range(20):
+            broker.sendall(publish_packet(b"stashbus/t", str(n).encode()))
+        await asyncio.sleep(0.05)
+        assert client.paused and len(client.messages) == 3
+        received = []
+        for _ in range(20):
+            message = await asyncio.wait_for(client._queue.get(), 1)
+            received.append(int(message.payload))  # type: ignore[arg-type]
+            assert len(client.messages) <= 3
+            await asyncio.sleep(0.001)
+        ours.close()
+        broker.close()
+        return received
+
+    assert asyncio.run(consume()) == list(range(20))
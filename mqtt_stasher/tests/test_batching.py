@@ -0,0 +1,30 @@
+from stashbus.mqtt_stasher.batching import TopicBatcher
+
+
+def test_flushes_when_full():
+    batcher = TopicBatcher(max_size=3, max_linger=60)
+    assert batcher.add("stashbus/a", {"n": 1}) is None
+    assert batcher.add("stashbus/b", {"n": 2}) is None
+    assert batcher.add("stashbus/a", {"n": 3}) is None
+    assert batcher.add("stashbus/a", {"n": 4}) == [{"n": 1}, {"n": 3}, {"n": 4}]
+    assert batcher.pending() == 1
+
+
+def test_expired_batches():
+    batcher = TopicBatcher(max_size=100, max_linger=5)
+    batcher.add("stashbus/a", {"n": 1})
+    opened_at = batcher._opened_at["stashbus/a"]
+    assert batcher.expired(now=opened_at + 1) == []
+    assert batcher.expired(now=opened_at + 5) == [("stashbus/a", [{"n": 1}])]
+    assert batcher.pending() == 0
+
+
+def test_drain():
+    batcher = TopicBatcher(max_size=100, max_linger=5)
+    batcher.add("stashbus/a", {"n": 1})
+    batcher.add("stashbus/b", {"n": 2})
+    assert sorted(batcher.drain()) == [
+        ("stashbus/a", [{"n": 1}]),
+        ("stashbus/b", [{"n": 2}]),
+    ]
+    assert batcher.drain() == []
@@ -0,0 +1,45 @@
+from datetime import datetime
+
+from stashbus.models.mqtt_models import Envelope, Payload, Price, Quote
+from stashbus.mqtt_stasher.mqtt_stasher import StashbusSub
+from stashbus.mqtt_stasher.receive_queue import Received
+
+
+def subscriber(**kwargs) -> StashbusSub:
+    return StashbusSub(
+        "localhost", 1883, None, None, None, "mongodb://localhost:1/", "t", **kwargs
+    )
+
+
+def quote(minute: int, usd: float) -> Quote:
+    return Quote(received_at=datetime(2025, 6, 1, 10, minute), price=Price(USD=usd))
+
+
+def test_envelope_is_one_bulk_write():
+    sub = subscriber()
+    stored = []
+    sub.store = lambda topic, docs: stored.append((topic, docs))  # type: ignore[method-assign]
+    envelope = Envelope[Payload](samples=[quote(0, 1.0), quote(1, 2.0)])
+    sub.process(Received("stashbus/prices/btc", envelope.model_dump_json().encode()))
+
+    [(topic, docs)] = stored
+    assert topic == "stashbus/prices/btc"
+    assert [doc["received_at"] for doc in docs] == [
+        "2025-06-01T10:00:00",
+        "2025-06-01T10:01:00",
+    ]
+    assert [doc["price"]["USD"] for doc in docs] == [1.0, 2.0]
+
+
+def test_plain_payload_and_batching():
+    sub = subscriber(batch_size=3)
+    stored = []
+    sub.store = lambda topic, docs: stored.append(docs)  # type: ignore[method-assign]
+    sub.process(Received("t", quote(0, 1.0).model_dump_json().encode()))
+    envelope = Envelope[Payload](samples=[quote(1, 2.0), quote(2, 3.0), quote(3, 4.0)])
+    sub.process(Received("t", envelope.model_dump_json().encode()))
+
+    assert [[doc["price"]["USD"] for doc in docs] for docs in stored] == [
+        [1.0, 2.0, 3.0]
+    ]
+    assert sub.batcher is not None and sub.batcher.pending() == 1
@@ -0,0 +1,35 @@
+from pathlib import Path
+
+from stashbus.mqtt_stasher.launcher import worker_kwargs
+from stashbus.mqtt_stasher.mqtt_stasher import StashbusSub
+
+
+def test_worker_kwargs_split_spool_and_metrics_port():
+    kwargs = {"spool_dir": "/var/spool/stasher", "metrics_port": 9100, "writers": 2}
+    assert worker_kwargs(kwargs, 0) == {
+        "spool_dir": str(Path("/var/spool/stasher/worker-0")),
+        "metrics_port": 9100,
+        "writers": 2,
+    }
+    second = worker_kwargs(kwargs, 1)
+    assert second["spool_dir"] == str(Path("/var/spool/stasher/worker-1"))
+    assert second["metrics_port"] == 9101
+    assert kwargs["spool_dir"] == "/var/spool/stasher"
+
+
+def test_worker_kwargs_without_spool_or_metrics():
+    kwargs = {"spool_dir": None, "metrics_port": None}
+    assert worker_kwargs(kwargs, 3) == kwargs
+
+
+def subscriber(**kwargs) -> StashbusSub:
+    return StashbusSub(
+        "localhost", 1883, None, None, None, "mongodb://localhost:1/", "t", **kwargs
+    )
+
+
+def test_shared_subscription():
+    assert subscriber().subscription == "stashbus/#"
+    assert subscriber(share_group="stashers").subscription == (
+        "$share/stashers/stashbus/#"
+    )
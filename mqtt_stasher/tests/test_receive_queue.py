@@ -0,0 +1,37 @@
+from typing import List
+
+import pytest
+
+from stashbus.mqtt_stasher.receive_queue import (
+    Overflow,
+    Received,
+    ReceiveQueue,
+)
+
+
+def fill(received: ReceiveQueue, count: int):
+    for n in range(count):
+        received.put(Received("stashbus/test", str(n).encode()))
+
+
+def test_drop_oldest():
+    received = ReceiveQueue(2, Overflow.DROP_OLDEST)
+    fill(received, 3)
+    assert received.dropped == 1
+    assert received.high_watermark == 2
+    first = received.get(timeout=0)
+    assert first is not None and first.payload == b"1"
+
+
+def test_spill():
+    spilled: List[Received] = []
+    received = ReceiveQueue(1, Overflow.SPILL, spilled.append)
+    fill(received, 3)
+    assert received.spilled == 2
+    assert received.depth() == 1
+    assert [item.payload for item in spilled] == [b"1", b"2"]
+
+
+def test_spill_requires_callback():
+    with pytest.raises(ValueError):
+        ReceiveQueue(1, Overflow.SPILL)
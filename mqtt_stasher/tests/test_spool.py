@@ -0,0 +1,91 @@
+from pathlib import Path
+
+import bson
+import paho.mqtt.client as mqtt
+
+from stashbus.mqtt_stasher.mqtt_stasher import DECODE_FAILURES, StashbusSub
+from stashbus.mqtt_stasher.receive_queue import Overflow
+from stashbus.mqtt_stasher.spool import FsyncPolicy, Spool
+
+
+def replay(spool: Spool):
+    records = []
+    while (segment := spool.oldest()) is not None:
+        records.extend(spool.read(segment))
+        spool.remove(segment)
+    return records
+
+
+def test_replays_in_order(tmp_path: Path):
+    spool = Spool(tmp_path, segment_size=64, fsync=FsyncPolicy.ALWAYS)
+    assert spool.empty()
+    for n in range(10):
+        spool.append(f"stashbus/{n % 2}", [{"n": n}])
+    assert not spool.empty()
+    records = replay(spool)
+    assert [docs[0]["n"] for _, docs in records] == list(range(10))
+    assert records[1] == ("stashbus/1", [{"n": 1}])
+    assert spool.empty()
+    assert spool.size() == 0
+
+
+def test_survives_restart(tmp_path: Path):
+    spool = Spool(tmp_path)
+    spool.append("stashbus/a", [{"n": 1}])
+    spool.close()
+    reopened = Spool(tmp_path)
+    assert replay(reopened) == [("stashbus/a", [{"n": 1}])]
+
+
+def test_discards_oldest_over_limit(tmp_path: Path):
+    spool = Spool(tmp_path, segment_size=1, max_bytes=100)
+    for n in range(10):
+        spool.append("stashbus/a", [{"n": n}])
+    assert spool.discarded_segments > 0
+    assert spool.size() <= 100
+    assert replay(spool)[-1] == ("stashbus/a", [{"n": 9}])
+
+
+def test_quarantines_torn_tail(tmp_path: Path):
+    spool = Spool(tmp_path)
+    spool.append("stashbus/a", [{"n": 1}])
+    spool.append("stashbus/a", [{"n": 2}])
+    spool.close()
+    segment = next(tmp_path.glob("*.seg"))
+    tail = bson.encode({"topic": "stashbus/a", "docs": [{"n": 3}]})[:-5]
+    with open(segment, "ab") as file:
+        file.write(tail)
+    reopened = Spool(tmp_path)
+    assert replay(reopened) == [("stashbus/a", [{"n": 1}]), ("stashbus/a", [{"n": 2}])]
+    assert reopened.torn_records == 1
+    assert segment.with_suffix(".torn").read_bytes() == tail
+
+
+def message(topic: str, payload: bytes) -> mqtt.MQTTMessage:
+    msg = mqtt.MQTTMessage(topic=topic.encode())
+    msg.payload = payload
+    return msg
+
+
+def test_spill_survives_undecodable_payload(tmp_path: Path):
+    sub = StashbusSub(
+        "localhost",
+        1883,
+        None,
+        None,
+        None,
+        "mongodb://localhost:1/",
+        "t",
+        queue_size=1,
+        overflow=Overflow.SPILL,
+        spool_dir=str(tmp_path),
+    )
+    failures = DECODE_FAILURES.labels("stashbus/t")
+    before = failures.value
+    sub.on_message(None, None, message("stashbus/t", b'{"n": 1}'))  # type: ignore[arg-type]
+    sub.on_message(None, None, message("stashbus/t", b'{"n": 2}'))  # type: ignore[arg-type]
+    sub.on_message(None, None, message("stashbus/t", b"not json"))  # type: ignore[arg-type]
+    assert failures.value == before + 1
+    assert sub.spool is not None
+    [(topic, docs)] = replay(sub.spool)
+    assert topic == "stashbus/t" and docs[0]["n"] == 2
@@ -0,0 +1,167 @@
+import asyncio
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+from unittest.mock import MagicMock
+
+from pymongo.errors import DuplicateKeyError
+
+from stashbus.mqtt_stasher.async_engine import AsyncCollectionManager
+from stashbus.mqtt_stasher.bench import MockCollection
+from stashbus.mqtt_stasher.storage import (
+    CollectionManager,
+    StorageConfig,
+    StorageMode,
+    bucket_update,
+    write_buckets,
+)
+
+CONFIG = """
+mode = "timeseries"
+
+[[indexes]]
+topic = "stashbus/prices/#"
+keys = [["received_at", -1]]
+"""
+
+
+def test_load(tmp_path: Path):
+    path = tmp_path / "storage.toml"
+    path.write_text(CONFIG)
+    config = StorageConfig.load(str(path))
+    assert config.mode is StorageMode.TIMESERIES
+    assert config.indexes[0].keys == [("received_at", -1)]
+
+
+def test_prepare_timeseries_document():
+    manager = CollectionManager(MagicMock(), StorageConfig(mode=StorageMode.TIMESERIES))
+    doc: Dict[str, Any] = {"received_at": "2025-06-01T10:00:00", "temp": 20.0}
+    manager.prepare("stashbus/weather/brno", doc)
+    assert doc["received_at"] == datetime(2025, 6, 1, 10)
+    assert doc["meta"] == {"topic": "stashbus/weather/brno"}
+
+
+def test_prepare_fixes_the_id():
+    manager = CollectionManager(MagicMock(), StorageConfig())
+    doc = manager.prepare("stashbus/a", {"n": 1})
+    assert doc["_id"] == manager.prepare("stashbus/a", doc)["_id"]
+    bucket = CollectionManager(MagicMock(), StorageConfig(mode=StorageMode.BUCKET))
+    assert "_id" not in bucket.prepare("stashbus/a", {"received_at": None})
+
+
+def test_ensure_creates_collection_once():
+    db = MagicMock()
+    config = StorageConfig.model_validate(
+        {
+            "mode": "timeseries",
+            "indexes": [{"topic": "stashbus/prices/#", "keys": [["received_at", -1]]}],
+        }
+    )
+    manager = CollectionManager(db, config)
+    for topic in ["stashbus/prices/btc_usd", "stashbus/prices/btc_usd", "stashbus/x"]:
+        manager.ensure(topic)
+    created: List[str] = [call.args[0] for call in db.create_collection.call_args_list]
+    assert created == ["stashbus/prices/btc_usd", "stashbus/x"]
+    assert db.create_collection.call_args.kwargs["timeseries"]["timeField"] == (
+        "received_at"
+    )
+    db["stashbus/prices/btc_usd"].create_index.assert_called_once_with(
+        [("received_at", -1)], name=None
+    )
+
+
+def test_async_ensure_shares_the_setup():
+    db = MagicMock()
+    manager = AsyncCollectionManager(db, StorageConfig(mode=StorageMode.TIMESERIES))
+
+    async def ensure_twice():
+        await asyncio.gather(*(manager.aensure("stashbus/x") for _ in range(2)))
+
+    asyncio.run(ensure_twice())
+    db.create_collection.assert_called_once()
+    assert db.create_collection.call_args.args == ("stashbus/x",)
+
+
+def test_bucket_update():
+    config = StorageConfig(mode=StorageMode.BUCKET, bucket_seconds=60)
+    docs = [
+        {"received_at": datetime(2025, 6, 1, 10, 0, 5), "price": {"USD": 3.0}},
+        {"received_at": datetime(2025, 6, 1, 10, 0, 50), "price": {"USD": 1.0}},
+    ]
+    update = bucket_update(
+        config, "stashbus/prices/btc_usd", datetime(2025, 6, 1, 10), docs
+    )
+    assert update["$inc"] == {"count": 2}
+    assert update["$min"]["min.price.USD"] == 1.0
+    assert update["$max"]["max.price.USD"] == 3.0
+    assert update["$max"]["last_at"] == datetime(2025, 6, 1, 10, 0, 50)
+    assert update["$setOnInsert"]["window_end"] == datetime(2025, 6, 1, 10, 1)
+
+
+class Buckets:
+    """Just enough of a collection with the unique (window_start, seq) index."""
+
+    def __init__(self):
+        self.buckets: Dict[Tuple[datetime, int], Dict[str, Any]] = {}
+        self.before_update = lambda: None
+
+    def find_one(self, query: Dict[str, Any], projection: Dict[str, Any]):
+        return self.buckets.get((query["window_start"], query["seq"]))
+
+    def update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool):
+        self.before_update()
+        key = (query["window_start"], query["seq"])
+        bucket = self.buckets.get(key)
+        room = query["count"]
+        if bucket is None:
+            if not upsert:
+                return
+            bucket = self.buckets[key] = {"count": room.get("$eq", 0), "samples": []}
+        elif not (
+            bucket["count"] <= room["$lte"]
+            if "$lte" in room
+            else bucket["count"] == room["$eq"]
+        ):
+            raise DuplicateKeyError("E11000")
+        bucket["count"] += update["$inc"]["count"]
+        bucket["samples"].extend(update["$push"]["samples"]["$each"])
+
+
+def samples(n: int, offset: int = 0) -> List[Dict[str, Any]]:
+    return [
+        {"received_at": datetime(2025, 6, 1, 10, 0, 5), "n": offset + i}
+        for i in range(n)
+    ]
+
+
+def test_write_buckets_never_overfills():
+    config = StorageConfig(mode=StorageMode.BUCKET, bucket_max_samples=4)
+    collection = Buckets()
+    write_buckets(collection, config, "stashbus/t", samples(3))  # type: ignore[arg-type]
+    write_buckets(collection, config, "stashbus/t", samples(6, 3))  # type: ignore[arg-type]
+    counts = [bucket["count"] for bucket in collection.buckets.values()]
+    assert counts == [4, 4, 1]
+    ns = [s["n"] for b in collection.buckets.values() for s in b["samples"]]
+    assert ns == list(range(9))
+
+
+def test_write_buckets_retries_a_concurrent_write():
+    config = StorageConfig(mode=StorageMode.BUCKET, bucket_max_samples=4)
+    collection = Buckets()
+    start = datetime(2025, 6, 1, 10)
+
+    def concurrent_writer():
+        collection.before_update = lambda: None
+        collection.buckets[(start, 0)] = {"count": 3, "samples": samples(3, 100)}
+
+    collection.before_update = concurrent_writer
+    write_buckets(collection, config, "stashbus/t", samples(2))  # type: ignore[arg-type]
+    assert [b["count"] for b in collection.buckets.values()] == [4, 1]
+
+
+def test_bench_mock_fills_the_buckets():
+    config = StorageConfig(mode=StorageMode.BUCKET, bucket_max_samples=4)
+    collection = MockCollection(0.0)
+    for offset in range(0, 9, 3):
+        write_buckets(collection, config, "stashbus/t", samples(3, offset))  # type: ignore[arg-type]
+    assert list(collection.counts.values()) == [4, 4, 1]
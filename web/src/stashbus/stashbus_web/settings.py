@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -130,3 +131,14 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# MQTT broker the producer commands are pushed to. Pushing is disabled when
+# no host is configured, the producers then keep polling the REST API.
+
+STASHBUS_MQTT = {
+    "HOST": os.environ.get("STASHBUS_MQTT_HOST"),
+    "PORT": int(os.environ.get("STASHBUS_MQTT_PORT", "1883")),
+    "CA_CERTS": os.environ.get("STASHBUS_MQTT_CA_CERTS"),
+    "CERTFILE": os.environ.get("STASHBUS_MQTT_CERTFILE"),
+    "KEYFILE": os.environ.get("STASHBUS_MQTT_KEYFILE"),
+}
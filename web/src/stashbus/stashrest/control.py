@@ -0,0 +1,93 @@
+"""Pushes the producer commands to the MQTT control topics.
+
+The messages are retained, so a producer learns its command as soon as it
+subscribes, without asking the REST API.
+
+Every web process keeps one MQTT connection, shared by the request threads.
+A push made while the broker is unreachable stays queued in the client and
+is sent on reconnect; the producers also check a pushed command against the
+REST API every now and then, in case it was lost anyway. A push which cannot
+even be queued fails the request.
+"""
+
+import logging
+import ssl
+import threading
+
+import paho.mqtt.client as mqtt
+from django.conf import settings
+from paho.mqtt.enums import CallbackAPIVersion
+from rest_framework.exceptions import APIException
+
+from stashbus.models.rest_models import (
+    DataProducer as DataProducerMessage,
+    producer_control_topic,
+)
+from stashrest.models import DataProducer
+
+logger = logging.getLogger(__name__)
+
+# Seconds a request waits for the broker to acknowledge a push.
+PUSH_TIMEOUT = 2.0
+MAX_QUEUED = 1000
+
+_client: mqtt.Client | None = None
+_client_lock = threading.Lock()
+
+
+class PushFailed(APIException):
+    status_code = 503
+    default_detail = "The command could not be pushed to the MQTT broker."
+    default_code = "push_failed"
+
+
+def client() -> mqtt.Client | None:
+    """The MQTT client of this process, connected in the background."""
+    global _client
+    config = settings.STASHBUS_MQTT
+    if not config["HOST"]:
+        return None
+    with _client_lock:
+        if _client is None:
+            _client = mqtt.Client(CallbackAPIVersion.VERSION2)
+            if config["CA_CERTS"]:
+                _client.tls_set(
+                    ca_certs=config["CA_CERTS"],
+                    certfile=config["CERTFILE"],
+                    keyfile=config["KEYFILE"],
+                    cert_reqs=ssl.CERT_REQUIRED,
+                )
+            _client.max_queued_messages_set(MAX_QUEUED)
+            _client.connect_async(config["HOST"], config["PORT"])
+            _client.loop_start()
+        return _client
+
+
+def publish(pk: int, payload: bytes) -> bool:
+    """Publish the retained command of producer ``pk``, ``True`` once the
+    broker has it, ``False`` while it is queued for the next connection."""
+    mqtt_cli = client()
+    if mqtt_cli is None:
+        return False
+    info = mqtt_cli.publish(producer_control_topic(pk), payload, qos=1, retain=True)
+    if info.rc == mqtt.MQTT_ERR_NO_CONN:
+        logger.warning(f"Not connected, queued the command of {pk}.")
+        return False
+    try:
+        info.wait_for_publish(PUSH_TIMEOUT)
+    except (RuntimeError, ValueError) as exc:
+        logger.error(f"Failed pushing the command of {pk}: {exc}")
+        raise PushFailed() from exc
+    return info.is_published()
+
+
+def push_command(data_producer: DataProducer) -> bool:
+    message = DataProducerMessage(
+        name=data_producer.name, command=data_producer.command
+    )
+    return publish(data_producer.pk, message.model_dump_json().encode())
+
+
+def clear_command(pk: int) -> bool:
+    """Remove the retained command, the producer falls back to polling."""
+    return publish(pk, b"")
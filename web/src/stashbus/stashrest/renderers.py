@@ -0,0 +1,21 @@
+from typing import Any, Mapping
+
+from rest_framework.renderers import JSONRenderer
+
+from stashbus.codecs import get_codec
+
+
+class CodecJSONRenderer(JSONRenderer):
+    """JSON renderer backed by the fastest codec available."""
+
+    codec = get_codec()
+
+    def render(
+        self,
+        data: Any,
+        accepted_media_type: str | None = None,
+        renderer_context: Mapping[str, Any] | None = None,
+    ) -> bytes:
+        if data is None:
+            return b""
+        return self.codec.dumps(data)
@@ -1,3 +1,103 @@
-from django.test import TestCase
+import json
+from unittest import mock
 
-# Create your tests here.
+from rest_framework.test import APITestCase
+
+from stashbus.models.rest_models import producer_control_topic
+from stashrest.models import DataProducer
+
+
+class CommandPushTests(APITestCase):
+    def setUp(self):
+        self.mqtt_cli = mock.MagicMock()
+        self.info = self.mqtt_cli.publish.return_value
+        self.info.rc = 0
+        self.info.is_published.return_value = True
+        patcher = mock.patch("stashrest.control.client", return_value=self.mqtt_cli)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def published(self):
+        (topic, payload), kwargs = self.mqtt_cli.publish.call_args
+        self.assertEqual(kwargs, {"qos": 1, "retain": True})
+        return topic, json.loads(payload) if payload else payload
+
+    def test_create_pushes_retained_command(self):
+        response = self.client.post(
+            "/data_producers/", {"name": "p", "command": "STOP"}, format="json"
+        )
+        self.assertEqual(response.status_code, 201)
+        producer = DataProducer.objects.get()
+        self.assertEqual(
+            self.published(),
+            (producer_control_topic(producer.pk), {"name": "p", "command": "STOP"}),
+        )
+
+    def test_update_pushes_retained_command(self):
+        producer = DataProducer.objects.create(name="p")
+        response = self.client.patch(
+            f"/data_producers/{producer.pk}/", {"command": "STOP"}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.published()[1]["command"], "STOP")
+
+    def test_stop_reports_the_push(self):
+        producer = DataProducer.objects.create(name="p")
+        response = self.client.post(f"/data_producers/{producer.pk}/stop/")
+        self.assertEqual(response.json(), {"status": "OK", "pushed": True})
+        self.assertEqual(self.published()[1]["command"], "STOP")
+
+    def test_delete_clears_retained_command(self):
+        producer = DataProducer.objects.create(name="p")
+        response = self.client.delete(f"/data_producers/{producer.pk}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.published(), (producer_control_topic(producer.pk), b""))
+
+    def test_failed_push_rolls_back(self):
+        producer = DataProducer.objects.create(name="p")
+        self.info.wait_for_publish.side_effect = ValueError("queue full")
+        response = self.client.post(f"/data_producers/{producer.pk}/stop/")
+        self.assertEqual(response.status_code, 503)
+        producer.refresh_from_db()
+        self.assertEqual(producer.command, DataProducer.Command.PRODUCE)
+
+        response = self.client.delete(f"/data_producers/{producer.pk}/")
+        self.assertEqual(response.status_code, 503)
+        self.assertTrue(DataProducer.objects.filter(pk=producer.pk).exists())
+
+
+class FleetCommandsTests(APITestCase):
+    def setUp(self):
+        self.first = DataProducer.objects.create(name="a")
+        self.second = DataProducer.objects.create(
+            name="b", command=DataProducer.Command.STOP
+        )
+
+    def test_all_producers(self):
+        response = self.client.get("/data_producers/commands/")
+        self.assertEqual(
+            response.json(),
+            {
+                str(self.first.pk): {"name": "a", "command": "PRODUCE"},
+                str(self.second.pk): {"name": "b", "command": "STOP"},
+            },
+        )
+
+    def test_filter_by_ids(self):
+        response = self.client.get(f"/data_producers/commands/?ids={self.second.pk}")
+        self.assertEqual(list(response.json()), [str(self.second.pk)])
+
+    def test_bad_ids(self):
+        response = self.client.get("/data_producers/commands/?ids=1,x")
+        self.assertEqual(response.status_code, 400)
+
+    def test_etag_round_trip(self):
+        etag = self.client.get("/data_producers/commands/").headers["ETag"]
+        response = self.client.get("/data_producers/commands/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], etag)
+
+        DataProducer.objects.filter(pk=self.first.pk).update(command="STOP")
+        response = self.client.get("/data_producers/commands/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
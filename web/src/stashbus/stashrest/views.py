@@ -1,4 +1,6 @@
+from django.db import transaction
 from django.shortcuts import render
+from django.utils.http import parse_etags, quote_etag
 
 from django.contrib.auth.models import Group, User
 from stashrest.models import DataProducer, Secret
@@ -8,6 +10,7 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework.decorators import action
+from rest_framework.renderers import BrowsableAPIRenderer
 
 from stashrest.serializers import (
     DataProducerSerializer,
@@ -15,12 +18,15 @@ from stashrest.serializers import (
     GroupSerializer,
     UserSerializer,
 )
-from stashrest.mongo import brno_weather, btc_prices
+from stashrest.control import clear_command, push_command
+from stashrest.mongo import brno_weather, btc_prices, latest
+from stashrest.renderers import CodecJSONRenderer
 from stashrest.models import OWMPayload, Quote, DataProducer
-
-from typing import Dict, List, Any
+from stashbus.models.adapters import documents
 
 
+import hashlib
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -35,21 +41,62 @@ class DataProducerViewSet(viewsets.ModelViewSet):
     serializer_class = DataProducerSerializer
     permission_classes = [permissions.AllowAny]
 
+    # A change whose push fails is rolled back, so the database never
+    # disagrees with the retained command.
+    @transaction.atomic
+    def perform_create(self, serializer):
+        push_command(serializer.save())
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        push_command(serializer.save())
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        pk = instance.pk
+        instance.delete()
+        clear_command(pk)
+
+    @action(detail=False, methods=["get"])
+    def commands(self, request):
+        """Names and commands of the producers listed in ``?ids=1,2``, or of
+        all of them, in one response with an ETag for conditional requests."""
+        producers = DataProducer.objects.order_by("pk")
+        if ids := request.query_params.get("ids"):
+            try:
+                producers = producers.filter(pk__in=[int(pk) for pk in ids.split(",")])
+            except ValueError:
+                return Response(
+                    {"ids": "Expected comma separated integers."}, status=400
+                )
+        states = {
+            str(pk): {"name": name, "command": command}
+            for pk, name, command in producers.values_list("pk", "name", "command")
+        }
+        etag = quote_etag(
+            hashlib.sha1(json.dumps(states, sort_keys=True).encode()).hexdigest()
+        )
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            return Response(status=304, headers={"ETag": etag})
+        return Response(states, headers={"ETag": etag})
+
     @action(detail=True, methods=["post"])
+    @transaction.atomic
     def stop(self, request, pk=None):
         logger.debug(f"Stopping DataProducer with pk={pk}")
         data_producer: DataProducer = self.get_object()
         data_producer.command = DataProducer.Command.STOP
         data_producer.save()
-        return Response({"status": "OK"})
+        return Response({"status": "OK", "pushed": push_command(data_producer)})
 
     @action(detail=True, methods=["post"])
+    @transaction.atomic
     def produce(self, request, pk=None):
         logger.debug(f"Stopping DataProducer with pk={pk}")
         data_producer: DataProducer = self.get_object()
         data_producer.command = DataProducer.Command.PRODUCE
         data_producer.save()
-        return Response({"status": "OK"})
+        return Response({"status": "OK", "pushed": push_command(data_producer)})
 
 
 class SecretViewSet(viewsets.ModelViewSet):
@@ -83,26 +130,24 @@ class GroupViewSet(viewsets.ModelViewSet):
 
 
 class BrnoWeatherListView(APIView):
-    def get(self, request: Request) -> Response:
-        cursor = brno_weather.find().sort("timestamp", -1).limit(100)
-        results: List[Dict[str, Any]] = []
+    renderer_classes = [CodecJSONRenderer, BrowsableAPIRenderer]
 
-        for doc in cursor:
-            doc["_id"] = str(doc["_id"])  # Convert ObjectId
-            entry = OWMPayload(**doc)
-            results.append(entry.model_dump())
+    def get(self, request: Request) -> Response:
+        docs = list(latest(brno_weather, 100))
+        for doc in docs:
+            if "_id" in doc:
+                doc["_id"] = str(doc["_id"])  # Convert ObjectId
 
-        return Response(results)
+        return Response(documents(OWMPayload, docs))
 
 
 class BTCPriceListView(APIView):
-    def get(self, request: Request) -> Response:
-        cursor = btc_prices.find().sort("timestamp", -1).limit(100)
-        results: List[Dict[str, Any]] = []
+    renderer_classes = [CodecJSONRenderer, BrowsableAPIRenderer]
 
-        for doc in cursor:
-            doc["_id"] = str(doc["_id"])  # Convert ObjectId
-            entry = Quote(**doc)
-            results.append(entry.model_dump())
+    def get(self, request: Request) -> Response:
+        docs = list(latest(btc_prices, 100))
+        for doc in docs:
+            if "_id" in doc:
+                doc["_id"] = str(doc["_id"])  # Convert ObjectId
 
-        return Response(results)
+        return Response(documents(Quote, docs))